@@ -16,37 +16,112 @@
 #
 
 import time
+import threading
+from .ordereddict import odict
 
-"Cache stuff. A naive implementation."
+"""
+Cache stuff. Entries live in namespaces, each with its own time
+to live and maximum number of entries. When a namespace is full,
+the least recently used entry is evicted. All functions may
+be called from several threads.
+"""
 
 
-_max_cache_age = 600  # seconds
-_stamp = time.time()
-_lists = {}
+_default_ttl = 600  # seconds
+_default_max_entries = 500
 
 
-def _clear():
-    global _stamp
-    global _lists
-    _stamp = time.time()
-    _lists = {}
+class _Namespace(object):
+    def __init__(self, name, ttl, max_entries):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = odict()  # key -> (stamp, value), oldest use first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
 
+    def retrieve(self, key):
+        try:
+            stamp, value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        if self.ttl and time.time() - stamp > self.ttl:
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.entries[key] = (stamp, value)
+        self.hits += 1
+        return value
 
-def is_cached(name):
-    if time.time() - _stamp > _max_cache_age:
-        _clear()
-    return name in _lists
+    def store(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        self.entries[key] = (time.time(), value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return value
 
 
-def store(name, lst):
-    _lists[name] = lst
-    return lst
+_namespaces = odict()
+_lock = threading.RLock()
 
 
-def retrieve(name):
-    if is_cached(name):
-        return _lists[name]
-    return None
+def namespace(name, ttl=_default_ttl, max_entries=_default_max_entries):
+    """
+    Set up a namespace. ttl is in seconds (None or 0 for no
+    expiry). Existing entries are kept.
+    """
+    with _lock:
+        ns = _namespaces.get(name)
+        if ns is None:
+            ns = _namespaces[name] = _Namespace(name, ttl, max_entries)
+        else:
+            ns.ttl, ns.max_entries = ttl, max_entries
+        return ns
+
+
+def _get(name):
+    return _namespaces.get(name) or namespace(name)
+
+
+def retrieve(name, key):
+    "Cached value or None."
+    with _lock:
+        return _get(name).retrieve(key)
+
+
+def store(name, key, value):
+    with _lock:
+        return _get(name).store(key, value)
+
+
+def invalidate(name=None, key=None):
+    """
+    Drop the key from the namespace, the whole namespace if no
+    key is given, or everything.
+    """
+    with _lock:
+        if name is None:
+            for ns in _namespaces.values():
+                ns.entries.clear()
+        elif key is None:
+            _get(name).entries.clear()
+        else:
+            _get(name).entries.pop(key, None)
+
+
+def stats():
+    """
+    List of (namespace, entries, hits, misses, evictions,
+    expired) tuples.
+    """
+    with _lock:
+        return [(ns.name, len(ns.entries), ns.hits, ns.misses, ns.evictions, ns.expired)
+                for ns in _namespaces.values()]
 
 
 # vim:ts=4:sw=4:et:
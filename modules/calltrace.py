@@ -0,0 +1,127 @@
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''
+Tracing of external programs run by crmsh.
+
+Set CRM_TRACE_CALLS to "summary" to get a table of the programs
+run, with the time spent in each, on stderr at exit. Set it to a
+file name to have every call appended to that file as a line of
+JSON instead.
+'''
+
+import os
+import sys
+import time
+import atexit
+import json
+
+_target = os.getenv("CRM_TRACE_CALLS")
+_calls = []
+_command = None
+
+
+def set_command(name):
+    "The crmsh command on behalf of which programs are run."
+    global _command
+    _command = name
+
+
+def start():
+    '''
+    Call before running a program, pass the result to
+    record().
+    '''
+    if _target:
+        return time.time()
+    return None
+
+
+def record(cmd, started, rc, bytes_in=None, bytes_out=None):
+    if started is None:
+        return
+    _calls.append({
+        "argv": cmd,
+        "time": round(time.time() - started, 6),
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "rc": rc,
+        "command": _command,
+    })
+
+
+def _program(cmd):
+    "Name of the program, without sudo and path."
+    if isinstance(cmd, basestring):
+        cmd = cmd.split()
+    cmd = list(cmd)
+    if cmd[:2] == ["sudo", "-E"] and len(cmd) > 4:
+        cmd = cmd[4:]
+    while cmd and '=' in cmd[0] and not cmd[0].startswith('/'):
+        cmd = cmd[1:]  # environment
+    return cmd and os.path.basename(cmd[0]) or '?'
+
+
+def summary():
+    '''
+    List of (program, calls, failed, total time, max time,
+    bytes in, bytes out), most time consuming first.
+    '''
+    d = {}
+    for c in _calls:
+        prog = _program(c["argv"])
+        st = d.setdefault(prog, [prog, 0, 0, 0.0, 0.0, 0, 0])
+        st[1] += 1
+        if c["rc"] != 0:
+            st[2] += 1
+        st[3] += c["time"]
+        st[4] = max(st[4], c["time"])
+        st[5] += c["bytes_in"] or 0
+        st[6] += c["bytes_out"] or 0
+    return sorted([tuple(st) for st in d.values()], key=lambda st: -st[3])
+
+
+def _print_summary(f):
+    fmt = "%-20s %6s %6s %10s %10s %10s %10s"
+    print >> f, fmt % ("program", "calls", "failed", "total(s)", "max(s)", "in", "out")
+    calls = total = 0
+    for st in summary():
+        print >> f, fmt % (st[0], st[1], st[2], "%.3f" % st[3], "%.3f" % st[4], st[5], st[6])
+        calls += st[1]
+        total += st[3]
+    print >> f, fmt % ("total", calls, "", "%.3f" % total, "", "", "")
+
+
+def _exit_handler():
+    "Called at program exit"
+    if not _target or not _calls:
+        return
+    if _target == "summary":
+        _print_summary(sys.stderr)
+        return
+    try:
+        f = open(_target, "a")
+        try:
+            for c in _calls:
+                f.write(json.dumps(c) + "\n")
+        finally:
+            f.close()
+    except IOError, msg:
+        print >> sys.stderr, "%s: %s" % (_target, msg)
+
+
+if _target:
+    atexit.register(_exit_handler)
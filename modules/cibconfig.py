@@ -27,11 +27,11 @@ from . import config
 from . import options
 from . import constants
 from . import tmpfiles
-from .parse import CliParser
+from .parse import CliParser, parse_statements
 from . import clidisplay
 from .cibstatus import cib_status
 from . import idmgmt
-from .ra import get_ra, get_properties_list, get_pe_meta
+from .ra import get_ra, get_properties_list, get_pe_meta, prefetch_meta
 from . import schema
 from .crm_gv import gv_types
 from .msg import common_warn, common_err, common_debug, common_info, err_buf
@@ -41,7 +41,7 @@ from .msg import invalid_id_err, cib_ver_unsupported_err
 from . import utils
 from .utils import ext_cmd, safe_open_w, pipe_string, safe_close_w, crm_msec
 from .utils import ask, lines2cli, olist
-from .utils import page_string, cibadmin_can_patch, str2tmp
+from .utils import page_strings, cibadmin_can_patch, cibadmin_can_patch_v2, str2tmp
 from .utils import run_ptest, is_id_valid, edit_file, get_boolean, filter_string
 from .ordereddict import odict
 from .orderedset import oset
@@ -56,13 +56,16 @@ from .xmlutil import remove_id_used_attributes, get_top_cib_nodes
 from .xmlutil import merge_attributes, is_cib_element, sanity_check_meta
 from .xmlutil import is_simpleconstraint, is_template, rmnode, is_defaults, is_live_cib
 from .xmlutil import get_rsc_operations, delete_rscref, xml_equals, lookup_node, RscState
-from .xmlutil import cibtext2elem, is_related
+from .xmlutil import cibtext2elem, is_related, related_ids, cib_patch
+from .xmlutil import cached_cibdump2elem, clear_cibdump_cache
 from .cliformat import get_score, nvpairs2list, abs_pos_score, cli_acl_roleref, nvpair_format
 from .cliformat import cli_nvpair, cli_acl_rule, rsc_set_constraint, get_kind, head_id_format
 from .cliformat import cli_operations, simple_rsc_constraint, cli_rule, cli_format
 from .cliformat import cli_acl_role, cli_acl_permission
 from . import cibverify
 
+_glob_chars = re.compile(r'[*?[]')
+
 
 def show_unrecognized_elems(cib_elem):
     try:
@@ -324,14 +327,17 @@ class CibObjectSet(object):
         if options.batch:
             common_info("edit not allowed in batch mode")
             return False
-        with clidisplay.nopretty():
-            s = self.repr()
+        s = self._edit_repr()
         # don't allow edit if one or more elements were not
         # found
         if not self.search_rc:
             return self.search_rc
         return self._edit_save(s)
 
+    def _edit_repr(self):
+        with clidisplay.nopretty():
+            return self.repr()
+
     def _filter_save(self, filter, s):
         '''
         Pipe string s through a filter. Parse/save the output.
@@ -357,16 +363,14 @@ class CibObjectSet(object):
         f = safe_open_w(fname)
         if not f:
             return False
-        rc = True
+        empty = True
         with clidisplay.nopretty():
-            s = self.repr()
-        if s:
-            f.write(s)
-            f.write('\n')
-        elif self.obj_set:
-            rc = False
+            for s in self.repr_iter():
+                f.write(s)
+                f.write('\n')
+                empty = False
         safe_close_w(f)
-        return rc
+        return not (empty and self.obj_set)
 
     def _get_gv_obj(self, gtype):
         if not self.obj_set:
@@ -410,9 +414,7 @@ class CibObjectSet(object):
         return gv_obj.save(outf)
 
     def show(self):
-        s = self.repr()
-        if s:
-            page_string(s)
+        page_strings(self.repr_iter())
         return self.search_rc
 
     def import_file(self, method, fname):
@@ -436,6 +438,15 @@ class CibObjectSet(object):
         '''
         return ''
 
+    def repr_iter(self, format=1):
+        '''
+        Generate the representation piece by piece, so that it
+        can be output without building the whole string first.
+        '''
+        s = self.repr(format=format)
+        if s:
+            yield s
+
     def save(self, s, no_remove=False, method='replace'):
         '''
         For each object:
@@ -450,30 +461,26 @@ class CibObjectSet(object):
 
     def __check_unique_clash(self, set_obj_all):
         'Check whether resource parameters with attribute "unique" clash'
-        def process_primitive(prim, clash_dict):
+        def process_primitive(prim, r_node, ra, clash_dict):
             '''
             Update dict clash_dict with
             (ra_class, ra_provider, ra_type, name, value) -> [ resourcename ]
             if parameter "name" should be unique
             '''
             ra_id = prim.get("id")
-            r_node = reduce_primitive(prim)
-            if r_node is None:
-                return  # template not defined yet
-            ra_type = node.get("type")
-            ra_class = node.get("class")
-            ra_provider = node.get("provider")
-            ra = get_ra(r_node)
-            if ra.mk_ra_node() is None:  # no RA found?
+            ra_type = prim.get("type")
+            ra_class = prim.get("class")
+            ra_provider = prim.get("provider")
+            schema = ra.mk_ra_node()
+            if schema is None:  # no RA found?
                 return
-            ra_params = ra.params()
             for p in r_node.xpath("./instance_attributes/nvpair"):
                 name, value = p.get("name"), p.get("value")
                 if value is None:
                     continue
                 # don't fail if the meta-data doesn't contain the
                 # expected attributes
-                if name in ra_params and ra_params[name].get("unique") == "1":
+                if name in schema.unique:
                     clash_dict[(ra_class, ra_provider, ra_type, name, value)].append(ra_id)
             return
         # we check the whole CIB for clashes as a clash may originate between
@@ -483,11 +490,16 @@ class CibObjectSet(object):
                          if o.obj_type == "primitive"])
         if not check_set:
             return 0
-        clash_dict = defaultdict(list)
+        prims = []
         for obj in set_obj_all.obj_set:
-            node = obj.node
-            if is_primitive(node):
-                process_primitive(node, clash_dict)
+            if is_primitive(obj.node):
+                r_node = reduce_primitive(obj.node)
+                if r_node is not None:  # template not defined yet
+                    prims.append((obj.node, r_node, get_ra(r_node)))
+        prefetch_meta([ra for prim, r_node, ra in prims])
+        clash_dict = defaultdict(list)
+        for prim, r_node, ra in prims:
+            process_primitive(prim, r_node, ra, clash_dict)
         # but we only warn if a 'new' object is involved
         rc = 0
         for param, resources in clash_dict.items():
@@ -539,6 +551,7 @@ class CibObjectSetCli(CibObjectSet):
 
     def __init__(self, *args):
         CibObjectSet.__init__(self, *args)
+        self._fingerprints = {}
 
     def repr_nopretty(self, format=1):
         with clidisplay.nopretty():
@@ -546,10 +559,47 @@ class CibObjectSetCli(CibObjectSet):
 
     def repr(self, format=1):
         "Return a string containing cli format of all objects."
-        if not self.obj_set:
-            return ''
-        return '\n'.join(obj.repr_cli(format=format)
-                         for obj in processing_sort_cli(list(self.obj_set)))
+        return '\n'.join(self.repr_iter(format=format))
+
+    def repr_iter(self, format=1):
+        "Generate cli format of objects, one by one."
+        for obj in processing_sort_cli(list(self.obj_set)):
+            yield obj.repr_cli(format=format)
+
+    def edit(self):
+        try:
+            return CibObjectSet.edit(self)
+        finally:
+            self._fingerprints = {}
+
+    def _edit_repr(self):
+        '''
+        Remember the statements of each object, so that save()
+        can skip those which were not changed in the editor.
+        '''
+        with clidisplay.nopretty():
+            l = [(obj.obj_id, obj.repr_cli())
+                 for obj in processing_sort_cli(list(self.obj_set))]
+        self._fingerprints = dict(('\n'.join(lines2cli(s)), obj_id) for obj_id, s in l)
+        return '\n'.join(s for obj_id, s in l)
+
+    def _skip_unchanged(self, statements):
+        '''
+        Replace the statements (and their comments) of objects
+        which are as they were before the edit by None. Returns
+        the set of ids of these objects.
+        '''
+        unchanged = oset()
+        start = 0
+        for i, stmt in enumerate(statements):
+            if stmt.startswith('#'):
+                continue
+            obj_id = self._fingerprints.get('\n'.join(statements[start:i+1]))
+            if obj_id is not None and obj_id not in unchanged:
+                unchanged.add(obj_id)
+                statements[start:i+1] = [None] * (i + 1 - start)
+            start = i + 1
+        return unchanged
 
     def _pre_edit(self, s):
         '''Extra processing of the string to be edited'''
@@ -588,11 +638,10 @@ class CibObjectSetCli(CibObjectSet):
         id_set = oset()
         del_set = oset()
         rc = True
+        statements = lines2cli(s)
+        unchanged = self._skip_unchanged(statements)
         err_buf.start_tmp_lineno()
-        cp = CliParser()
-        for cli_text in lines2cli(s):
-            err_buf.incr_lineno()
-            node = cp.parse(cli_text)
+        for node in parse_statements(statements):
             if node not in (False, None):
                 obj_id = id_for_node(node)
                 if obj_id is None:
@@ -608,6 +657,11 @@ class CibObjectSetCli(CibObjectSet):
             elif node is False:
                 rc = False
         err_buf.stop_tmp_lineno()
+        for obj_id in unchanged:
+            if obj_id in id_set:
+                common_err("duplicate element %s" % obj_id)
+                rc = False
+            id_set.add(obj_id)
         # we can't proceed if there was a syntax error, but we
         # can ask the user to fix problems
         if not no_remove:
@@ -616,7 +670,7 @@ class CibObjectSetCli(CibObjectSet):
         if not rc:
             return rc
         mk_set = id_set - self.obj_ids
-        upd_set = id_set & self.obj_ids
+        upd_set = (id_set & self.obj_ids) - unchanged
 
         rc = cib_factory.set_update(edit_d, mk_set, upd_set, del_set,
                                     upd_type="cli", method=method)
@@ -634,9 +688,13 @@ class CibObjectSetRaw(CibObjectSet):
 
     def repr(self, format="ignored"):
         "Return a string containing xml of all objects."
-        cib_elem = cib_factory.obj_set2cib(self.obj_set)
-        s = etree.tostring(cib_elem, pretty_print=True)
-        return '<?xml version="1.0" ?>\n' + s
+        return '\n'.join(self.repr_iter())
+
+    def repr_iter(self, format="ignored"):
+        "Generate xml of all objects, in pieces of whole lines."
+        yield '<?xml version="1.0" ?>'
+        for s in cib_factory.obj_set2xml(self.obj_set, pretty_print=True):
+            yield s[:-1]  # without the newline
 
     def _get_id(self, node):
         if node.tag == "fencing-topology":
@@ -683,24 +741,19 @@ class CibObjectSetRaw(CibObjectSet):
     def verify(self):
         if not self.obj_set:
             return True
-        with clidisplay.nopretty():
-            cib = self.repr(format=-1)
-        rc = cibverify.verify(cib)
-
+        rc = cibverify.verify(cib_factory.obj_set2xml(self.obj_set, pretty_print=True))
         if rc not in (0, 1):
-            common_debug("verify (rc=%s): %s" % (rc, cib))
+            common_debug("verify failed (rc=%s)" % rc)
         return rc in (0, 1)
 
     def ptest(self, nograph, scores, utilization, actions, verbosity):
         if not cib_factory.is_cib_sane():
             return False
-        cib_elem = cib_factory.obj_set2cib(self.obj_set)
         status = cib_status.get_status()
         if status is None:
             common_err("no status section found")
             return False
-        cib_elem.append(copy.deepcopy(status))
-        graph_s = etree.tostring(cib_elem)
+        graph_s = cib_factory.obj_set2xml(self.obj_set, status=status)
         return run_ptest(graph_s, nograph, scores, utilization, actions, verbosity)
 
 
@@ -890,6 +943,7 @@ class CibObject(object):
     '''
     state_fmt = "%16s %-8s%-8s%-8s%-4s"
     set_names = {}
+    cli_cacheable = True
 
     def __init__(self, xml_obj_type):
         if xml_obj_type not in cib_object_map:
@@ -899,20 +953,56 @@ class CibObject(object):
         self.parent_type = cib_object_map[xml_obj_type][2]
         self.xml_obj_type = xml_obj_type
         self.origin = ""        # where did it originally come from?
-        self.nocli = False      # we don't support this one
+        self._nocli = False     # we don't support this one
+        self._unchecked = False  # loaded, but not yet validated
         self.nocli_warn = True  # don't issue warnings all the time
         self.updated = False    # was the object updated
         self.parent = None      # object superior (group/clone/ms)
         self.children = []      # objects inferior
         self.obj_id = None
         self.node = None
+        self._cli_cache = {}    # rendered CLI text
 
     def __str__(self):
         return "%s:%s" % (self.obj_type, self.obj_id)
 
+    def _get_nocli(self):
+        if self._unchecked:
+            self.materialize()
+        return self._nocli
+
+    def _set_nocli(self, value):
+        self._unchecked = False
+        self._nocli = value
+        self.clear_cli_cache()
+
+    nocli = property(_get_nocli, _set_nocli)
+
+    def materialize(self):
+        '''
+        Objects loaded from the CIB are checked for CLI
+        compatibility only when first used. The check does not
+        change the XML.
+        '''
+        if not self._unchecked:
+            return
+        self._unchecked = False
+        if not self.cli_use_validate():
+            self._nocli = True
+            self.nocli_warn = False
+            self.clear_cli_cache()
+            # no need to warn, user can see the object displayed as XML
+            common_debug("object %s cannot be represented in the CLI notation" % (self.obj_id))
+
+    def clear_cli_cache(self):
+        "The object changed, it has to be rendered again."
+        self._cli_cache = {}
+
     def set_updated(self):
         self.updated = True
+        self.clear_cli_cache()
         self.propagate_updated()
+        cib_factory.update_refs(self)
 
     def _dump_state(self):
         'Print object status'
@@ -963,6 +1053,20 @@ class CibObject(object):
     def repr_cli(self, format=1):
         '''
         CLI representation for the node.
+        The result is cached until the object changes.
+        '''
+        if not self.cli_cacheable:
+            return self._repr_cli(format)
+        key = (format, clidisplay.colors_enabled(),
+               config.serial(), cib_factory.id_refs_serial)
+        s = self._cli_cache.get(key)
+        if s is None:
+            s = self._repr_cli(format)
+            self._cli_cache[key] = s
+        return s
+
+    def _repr_cli(self, format):
+        '''
         _repr_cli_head and _repr_cli_child in subclasess.
         '''
         if self.nocli:
@@ -1139,6 +1243,9 @@ class CibObject(object):
         '''
         if self.node is None:
             return True
+        if self._unchecked:
+            self.materialize()
+            return not self._nocli
         with clidisplay.nopretty():
             cli_text = self.repr_cli(format=0)
         if not cli_text:
@@ -1202,6 +1309,7 @@ class CibObject(object):
     def propagate_updated(self):
         if self.parent:
             self.parent.updated = self.updated
+            self.parent.clear_cli_cache()
             self.parent.propagate_updated()
 
     def top_parent(self):
@@ -1921,6 +2029,8 @@ class CibFencingOrder(CibObject):
     '''
     Fencing order (fencing-topology).
     '''
+    # the representation depends on the number of nodes
+    cli_cacheable = False
 
     def set_id(self, obj_id=None):
         self.obj_id = "fencing_topology"
@@ -2096,6 +2206,92 @@ def can_migrate(node):
 cib_upgrade = "cibadmin --upgrade --force"
 
 
+def is_top_node(node):
+    "Is the node a direct child of a configuration section?"
+    p = node.getparent()
+    if p is None:
+        return False
+    return p.tag == "configuration" or \
+        (p.getparent() is not None and p.getparent().tag == "configuration")
+
+
+class UndoJournal(object):
+    '''
+    Changes made to the CIB objects since the journal was
+    started, so that they can be rolled back.
+    An object is saved the first time it is about to be
+    modified: the XML of its top parent and the state of the
+    top parent and all its children objects.
+    The place of the saved XML in the configuration section is
+    kept as the nearest preceding sibling which was not
+    modified at that time (the anchor).
+    '''
+    def __init__(self, factory):
+        self.factory = factory
+        self.saved = odict()    # cib object -> saved state
+        self.tops = []          # (obj, node, copy of node, section, anchor)
+        self.new_objs = set()   # objects created
+        self.obj_log = []       # (obj, position or None if added) for cib_objects
+        self.remove_queue_len = len(factory.remove_queue)
+        self.id_refs = dict(factory.id_refs)
+        self.cib_attrs = dict(factory.cib_attrs)
+        conf = get_topnode(factory.cib_elem, "configuration")
+        self.sections = list(conf) if conf is not None else []
+
+    def is_known(self, obj):
+        return obj in self.saved or obj in self.new_objs
+
+    def save(self, obj):
+        top = obj.top_parent()
+        if not self.is_known(top) and top.node is not None and is_top_node(top.node):
+            self.tops.append((top, top.node, copy.deepcopy(top.node),
+                              top.node.getparent(), self._anchor(top.node)))
+        self._save_state(top)
+        self._save_state(obj)
+
+    def _is_modified(self, node):
+        if node.getparent().tag == "configuration":
+            return node not in self.sections
+        for obj in self.factory._id_index.get(node.get("id"), ()):
+            if obj.node == node and self.is_known(obj):
+                return True
+        return False
+
+    def _anchor(self, node):
+        for sib in node.itersiblings(preceding=True):
+            if not self._is_modified(sib):
+                return sib
+        return None
+
+    def _save_state(self, obj):
+        if self.is_known(obj):
+            return
+        st = dict(obj.__dict__)
+        st["children"] = list(obj.children)
+        st["_cli_cache"] = {}
+        self.saved[obj] = st
+        for child in obj.children:
+            self._save_state(child)
+
+    def added(self, obj):
+        self.new_objs.add(obj)
+        self.obj_log.append((obj, None))
+
+    def removed(self, obj, pos):
+        self.obj_log.append((obj, pos))
+
+    def merge(self, inner):
+        "Merge the journal of a nested transaction."
+        for top_rec in inner.tops:
+            if not self.is_known(top_rec[0]):
+                self.tops.append(top_rec)
+        for obj, st in inner.saved.items():
+            if not self.is_known(obj):
+                self.saved[obj] = st
+        self.new_objs |= inner.new_objs
+        self.obj_log += inner.obj_log
+
+
 class CibFactory(object):
     '''
     Juggle with CIB objects.
@@ -2149,8 +2345,11 @@ class CibFactory(object):
     def check_structure(self):
         if not self.is_cib_sane():
             return False
+        return self._check_objects(self.cib_objects)
+
+    def _check_objects(self, objs):
         rc = True
-        for obj in self.cib_objects:
+        for obj in objs:
             if obj.parent:
                 if not self._check_parent(obj, obj.parent):
                     common_debug("check_parent failed: %s %s" % (obj.obj_id, obj.parent))
@@ -2282,27 +2481,61 @@ class CibFactory(object):
             self.cib_attrs[attr] = value
             cib.set(attr, value)
 
-    def obj_set2cib(self, obj_set, obj_filter=None):
+    def obj_set2xml(self, obj_set, obj_filter=None, status=None, pretty_print=False):
         '''
-        Return document containing objects in obj_set.
-        Must remove all children from the object list, because
-        printing xml of parents will include them.
+        Serialize a document containing objects in obj_set (and
+        the status section, if given) in pieces, straight from
+        the CIB, without building a new document first.
+        Only the top parents of the objects are output, printing
+        xml of parents includes the children.
         Optional filter to sieve objects.
         '''
-        cib_elem = new_cib()
-        # get only top parents for the objects in the list
-        # e.g. if we get a primitive which is part of a clone,
-        # then the clone gets in, not the primitive
-        # dict will weed out duplicates
-        d = {}
+        # section tag -> nodes, or obj -> node for the objects
+        # which are right in configuration (fencing-topology)
+        sections = odict((name, []) for name in schema.get('sub', "configuration", 'r'))
+        seen = set()
         for obj in obj_set:
             if obj_filter and not obj_filter(obj):
                 continue
-            d[obj.top_parent()] = 1
-        for obj in d:
-            get_topnode(cib_elem, obj.parent_type).append(copy.deepcopy(obj.node))
+            # e.g. if we get a primitive which is part of a clone,
+            # then the clone gets in, not the primitive
+            obj = obj.top_parent()
+            if obj in seen:
+                continue
+            seen.add(obj)
+            if obj.parent_type == "configuration":
+                sections[obj] = obj.node
+            else:
+                sections.setdefault(obj.parent_type, []).append(obj.node)
+
+        nl = pretty_print and '\n' or ''
+
+        def out(s, level):
+            if not pretty_print:
+                return s
+            return ''.join('  ' * level + l for l in s.splitlines(True))
+
+        def out_node(node, level):
+            return out(etree.tostring(node, pretty_print=pretty_print, with_tail=False), level)
+
+        cib_elem = etree.Element("cib")
         self._set_cib_attributes(cib_elem)
-        return cib_elem
+        yield etree.tostring(cib_elem)[:-2] + '>' + nl
+        yield out('<configuration>' + nl, 1)
+        for tag, nodes in sections.iteritems():
+            if not isinstance(tag, basestring):
+                yield out_node(nodes, 2)
+            elif not nodes:
+                yield out('<%s/>' % tag + nl, 2)
+            else:
+                yield out('<%s>' % tag + nl, 2)
+                for node in nodes:
+                    yield out_node(node, 3)
+                yield out('</%s>' % tag + nl, 2)
+        yield out('</configuration>' + nl, 1)
+        if status is not None:
+            yield out_node(status, 1)
+        yield '</cib>' + nl
 
     #
     # commit changed objects to the CIB
@@ -2312,7 +2545,7 @@ class CibFactory(object):
         return c.get(a) == self.cib_attrs.get(a)
 
     def is_current_cib_equal(self, silent=False):
-        cib_elem = read_cib(cibdump2elem)
+        cib_elem = read_cib(cached_cibdump2elem)
         if cib_elem is None:
             return False
         rc = self._attr_match(cib_elem, 'epoch') and \
@@ -2344,6 +2577,7 @@ class CibFactory(object):
         else:
             rc = self._replace_cib(force)
         if rc:
+            clear_cibdump_cache()
             # reload the cib!
             t = time.time()
             common_debug("CIB commit successful at %s" % (t))
@@ -2383,10 +2617,18 @@ class CibFactory(object):
         # copy the epoch from the current cib to both the target
         # cib and the original one (otherwise cibadmin won't want
         # to apply the patch)
-        current_cib = read_cib(cibdump2elem)
+        current_cib = read_cib(cached_cibdump2elem)
         if current_cib is None:
             return False
 
+        self._copy_cib_attributes(current_cib, self.cib_orig)
+        current_cib = None  # don't need that anymore
+        if config.core.cib_diff != "crm_diff" and cibadmin_can_patch_v2():
+            self._set_cib_attributes(self.cib_elem)
+            cib_diff = self._native_diff()
+            if cib_diff is not None:
+                return self._apply_diff(cib_diff, force)
+
         # check if crm_diff supports --no-version
         if self._crm_diff_cmd is None:
             rc, out = utils.get_stdout("crm_diff --help")
@@ -2395,8 +2637,6 @@ class CibFactory(object):
             else:
                 self._crm_diff_cmd = 'crm_diff'
 
-        self._copy_cib_attributes(current_cib, self.cib_orig)
-        current_cib = None  # don't need that anymore
         # only bump epoch if we don't have support for --no-version
         if not self._crm_diff_cmd.endswith('--no-version'):
             # now increase the epoch by 1
@@ -2407,7 +2647,6 @@ class CibFactory(object):
         if not tmpf:
             return False
         tmpfiles.add(tmpf)
-        cibadmin_opts = force and "-P --force" or "-P"
 
         # produce a diff:
         # dump_new_conf | crm_diff -o self.cib_orig -n -
@@ -2438,6 +2677,51 @@ class CibFactory(object):
                 if "digest" in tag.attrib:
                     del tag.attrib["digest"]
             cib_diff = etree.tostring(e)
+        return self._apply_diff(cib_diff, force)
+
+    def _native_diff(self):
+        """
+        Produce the patch from cib_orig to cib_elem without running
+        crm_diff, from the modified objects and the remove queue.
+        Returns None if crm_diff has to be used instead.
+        """
+        changed = set(obj.top_parent().node for obj in self.modified_elems())
+        removed = [obj.node for obj in self.remove_queue if obj.node is not None]
+        diff = cib_patch(self.cib_orig, self.cib_elem, changed, removed)
+        if diff is None:
+            common_debug("cannot produce the diff, using crm_diff")
+            return None
+        if len(diff) == 0:
+            return ''  # nothing to do
+        cib_diff = etree.tostring(diff)
+        if config.core.cib_diff == "verify" and not self._verify_diff(cib_diff):
+            common_warn("the generated diff is wrong, using crm_diff")
+            return None
+        return cib_diff
+
+    def _verify_diff(self, cib_diff):
+        """
+        Apply the diff to cib_orig using crm_diff and compare the
+        result with cib_elem.
+        """
+        tmpf = str2tmp(etree.tostring(self.cib_orig), suffix=".xml")
+        if not tmpf:
+            return False
+        tmpfiles.add(tmpf)
+        rc, s = filter_string("crm_diff -o %s -p -" % tmpf, cib_diff)
+        if rc != 0 or not s:
+            return False
+        cib_elem = cibtext2elem(s)
+        if cib_elem is None:
+            return False
+        sanitize_cib(cib_elem)
+        return etree.tostring(cib_elem.find("configuration")) == \
+            etree.tostring(self.cib_elem.find("configuration"))
+
+    def _apply_diff(self, cib_diff, force):
+        if not cib_diff:
+            return True
+        cibadmin_opts = force and "-P --force" or "-P"
         common_debug("Diff: %s" % (cib_diff))
         rc = pipe_string("%s %s" % (cib_piped, cibadmin_opts),
                          cib_diff)
@@ -2479,7 +2763,7 @@ class CibFactory(object):
         obj.origin = "cib"
         obj.node = node
         obj.set_id()
-        self.cib_objects.append(obj)
+        self._add_obj(obj)
         return obj
 
     def _populate(self):
@@ -2494,20 +2778,12 @@ class CibFactory(object):
             else:
                 self._create_object_from_cib(node)
         for obj in self.cib_objects:
+            # normalize now, before anything gets journaled
             obj.move_comments()
             fix_comments(obj.node)
-        self.cli_use_validate_all()
-        for obj in self.cib_objects:
+            obj._unchecked = True
             self._update_links(obj)
 
-    def cli_use_validate_all(self):
-        for obj in self.cib_objects:
-            if not obj.cli_use_validate():
-                obj.nocli = True
-                obj.nocli_warn = False
-                # no need to warn, user can see the object displayed as XML
-                common_debug("object %s cannot be represented in the CLI notation" % (obj.obj_id))
-
     def initialize(self, cib=None):
         if self.cib_elem is not None:
             return True
@@ -2528,47 +2804,219 @@ class CibFactory(object):
         self.cib_elem = None     # the cib
         self.cib_orig = None     # the CIB which we loaded
         self.cib_attrs = {}      # cib version dictionary
-        self.cib_objects = []    # a list of cib objects
+        self.cib_objects = oset()  # cib objects, in the CIB order
         self.remove_queue = []   # a list of cib objects to be removed
         self.id_refs = {}        # dict of id-refs
+        self.id_refs_serial = 0  # bumped when id_refs change
         self.new_schema = False  # schema changed
         self._state = []
+        self._id_index = {}      # obj_id -> list of cib objects
+        self._uname_index = {}   # node uname -> list of node objects
+        self._obj_uname = {}     # node object -> uname it is indexed by
+        self._refs = {}          # cib object -> ids it references
+        self._referrers = {}     # id -> set of objects referencing it
+        self._obj_pos = {}       # cib object -> serial, in the cib_objects order
+        self._obj_serial = 0
+
+    def _set_obj_pos(self, obj):
+        self._obj_serial += 1
+        self._obj_pos[obj] = self._obj_serial
+
+    def _renumber_objs(self):
+        "cib_objects changed other than by appending."
+        self._obj_pos = {}
+        self._obj_serial = 0
+        for obj in self.cib_objects:
+            self._set_obj_pos(obj)
+
+    def _in_cib_order(self, objs):
+        """
+        Sort objects in the cib_objects order, dropping those
+        which are not there anymore.
+        """
+        l = [x for x in objs if x in self._obj_pos]
+        l.sort(key=self._obj_pos.get)
+        return l
+
+    def _index_obj(self, obj):
+        "Add object to the lookup indexes."
+        if obj.obj_id is not None:
+            self._id_index.setdefault(obj.obj_id, []).append(obj)
+        if obj.obj_type == "node" and obj.node is not None:
+            uname = obj.node.get("uname")
+            if uname:
+                self._uname_index.setdefault(uname, []).append(obj)
+                self._obj_uname[obj] = uname
+        self._index_refs(obj)
+
+    def _index_refs(self, obj):
+        refs = obj.node is not None and related_ids(obj.node) or set()
+        self._refs[obj] = refs
+        for ref in refs:
+            self._referrers.setdefault(ref, set()).add(obj)
+
+    def _unindex_refs(self, obj):
+        for ref in self._refs.pop(obj, ()):
+            s = self._referrers.get(ref)
+            if s is not None:
+                s.discard(obj)
+                if not s:
+                    del self._referrers[ref]
+
+    def update_refs(self, obj):
+        """
+        Objects reference other objects by id (constraints,
+        tags, containers, template users). Refresh the reverse
+        reference index after the obj node changed. The change
+        shows in its parents too.
+        """
+        while obj is not None:
+            if obj in self._refs:
+                self._unindex_refs(obj)
+                self._index_refs(obj)
+            obj = obj.parent
+
+    def _referrers_of(self, obj_id):
+        "Objects referencing obj_id, in the cib_objects order."
+        return self._in_cib_order(self._referrers.get(obj_id, ()))
+
+    def _unindex_obj(self, obj):
+        "Remove object from the lookup indexes."
+        self._unindex_refs(obj)
+        l = self._id_index.get(obj.obj_id)
+        if l and obj in l:
+            l.remove(obj)
+            if not l:
+                del self._id_index[obj.obj_id]
+        uname = self._obj_uname.pop(obj, None)
+        if uname is not None:
+            l = self._uname_index[uname]
+            l.remove(obj)
+            if not l:
+                del self._uname_index[uname]
+
+    def _reindex_obj(self, obj):
+        "The object id or node uname may have changed."
+        self._unindex_obj(obj)
+        self._index_obj(obj)
+
+    def _add_obj(self, obj):
+        self.cib_objects.add(obj)
+        self._set_obj_pos(obj)
+        self._index_obj(obj)
+        if self._state:
+            self._state[-1].added(obj)
+
+    def _del_obj(self, obj):
+        self.cib_objects.discard(obj)
+        pos = self._obj_pos.pop(obj)
+        self._unindex_obj(obj)
+        if self._state:
+            self._state[-1].removed(obj, pos)
+
+    def _rebuild_index(self):
+        self._id_index = {}
+        self._uname_index = {}
+        self._obj_uname = {}
+        self._refs = {}
+        self._referrers = {}
+        self._renumber_objs()
+        for obj in self.cib_objects:
+            self._index_obj(obj)
 
     def _push_state(self):
         '''
-        A rudimentary instance state backup. Just make copies of
-        all important variables.
-        idmgmt has to be backed up too.
+        Start an undo journal. Objects are recorded in the
+        journal (see _touch) before they get modified.
+        idmgmt keeps its own journal.
         '''
-        self._state.append([copy.deepcopy(x)
-                            for x in (self.cib_elem,
-                                      self.cib_attrs,
-                                      self.cib_objects,
-                                      self.remove_queue,
-                                      self.id_refs)])
+        self._state.append(UndoJournal(self))
         idmgmt.push_state()
 
+    def _touch(self, obj):
+        "Object is about to be modified: save it for rollback."
+        if obj is None:
+            return
+        if self._state:
+            self._state[-1].save(obj)
+        while obj is not None:
+            obj.clear_cli_cache()
+            obj = obj.parent
+
+    def _relink_nodes(self, obj):
+        "Point children objects to their nodes within obj.node."
+        for child in obj.children:
+            child.node = obj.find_child_in_node(child)
+            if child.node is not None:
+                self._relink_nodes(child)
+
     def _pop_state(self):
+        '''
+        Roll back the changes recorded in the journal.
+        '''
         try:
-            common_debug("performing rollback from %s" % (self.cib_objects))
-            self.cib_elem, \
-                self.cib_attrs, self.cib_objects, \
-                self.remove_queue, self.id_refs = self._state.pop()
-        except KeyError:
+            j = self._state.pop()
+        except IndexError:
             return False
-        # need to get addresses of all new objects created by
-        # deepcopy
-        for obj in self.cib_objects:
-            obj.node = self.find_node(obj.xml_obj_type, obj.obj_id)
-            self._update_links(obj)
+        common_debug("performing rollback of %d objects" %
+                     (len(j.saved) + len(j.new_objs)))
+        # take out the XML of all modified and new objects
+        for obj in list(j.saved) + list(j.new_objs):
+            self._unindex_obj(obj)
+            if obj.node is not None and is_top_node(obj.node):
+                rmnode(obj.node)
+        for top_rec in j.tops:
+            rmnode(top_rec[1])
+        conf = get_topnode(self.cib_elem, "configuration")
+        for section in list(conf):
+            if section not in j.sections:
+                conf.remove(section)
+        # and put back the saved copies; an anchor may have been
+        # saved later, then it was put back already
+        restored = {}
+        for obj, node, node_copy, section, anchor in reversed(j.tops):
+            anchor = restored.get(anchor, anchor)
+            if anchor is None:
+                section.insert(0, node_copy)
+            else:
+                anchor.addnext(node_copy)
+            restored[node] = node_copy
+        for obj, st in j.saved.items():
+            obj.__dict__.clear()
+            obj.__dict__.update(st)
+        for obj, node, node_copy, section, anchor in j.tops:
+            obj.node = node_copy
+            self._relink_nodes(obj)
+        readded = set()
+        for obj, pos in reversed(j.obj_log):
+            if pos is None:
+                self.cib_objects.discard(obj)
+                self._obj_pos.pop(obj, None)
+                readded.discard(obj)
+            else:
+                self._obj_pos[obj] = pos
+                readded.add(obj)
+        if readded:
+            # back to their places
+            self.cib_objects = oset(sorted(list(self.cib_objects) + list(readded),
+                                           key=self._obj_pos.get))
+        del self.remove_queue[j.remove_queue_len:]
+        self.id_refs = j.id_refs
+        self.id_refs_serial += 1
+        self.cib_attrs = j.cib_attrs
+        for obj in j.saved:
+            self._index_obj(obj)
         idmgmt.pop_state()
-        return self.check_structure()
+        return self._check_objects(j.saved)
 
     def _drop_state(self):
         try:
-            self._state.pop()
-        except KeyError:
+            j = self._state.pop()
+        except IndexError:
             pass
+        else:
+            if self._state:
+                self._state[-1].merge(j)
         idmgmt.drop_state()
 
     def _clean_state(self):
@@ -2588,6 +3036,8 @@ class CibFactory(object):
         "Find objects for id (can be a wildcard-glob)."
         if not self.is_cib_sane() or obj_id is None:
             return None
+        if not _glob_chars.search(obj_id):
+            return self._lookup_objects(obj_id)
         matchfn = lambda x: x and fnmatch.fnmatch(x, obj_id)
         objs = []
         for obj in self.cib_objects:
@@ -2599,6 +3049,21 @@ class CibFactory(object):
                 objs.append(obj)
         return objs
 
+    def _lookup_objects(self, obj_id):
+        """
+        Exact id lookup: objects with this id and nodes with
+        this uname, in the cib_objects order.
+        """
+        objs = self._id_index.get(obj_id, [])
+        by_uname = self._uname_index.get(obj_id)
+        if by_uname:
+            objs = objs + [x for x in by_uname if x not in objs]
+            if len(objs) > 1:
+                objs = self._in_cib_order(objs)
+        else:
+            objs = objs[:]
+        return objs
+
     def find_object(self, obj_id):
         if not self.is_cib_sane():
             return None
@@ -2672,12 +3137,13 @@ class CibFactory(object):
     #
     def find_object_for_node(self, node):
         "Find an object which matches a dom node."
-        for obj in self.cib_objects:
-            if node.tag == "fencing-topology" and \
-                    obj.xml_obj_type == "fencing-topology":
-                return obj
-            if node.get("id") == obj.obj_id:
-                return obj
+        if node.tag == "fencing-topology":
+            for obj in self.cib_objects:
+                if obj.xml_obj_type == "fencing-topology":
+                    return obj
+        l = self._id_index.get(node.get("id"))
+        if l:
+            return l[0]
         return None
 
     def find_node(self, tag, id, strict=True):
@@ -2790,7 +3256,9 @@ class CibFactory(object):
         one, i.e. if the former is the case to find the right
         id to reference.
         '''
-        self.id_refs[id_ref] = attr_list_type
+        if self.id_refs.get(id_ref) != attr_list_type:
+            self.id_refs[id_ref] = attr_list_type
+            self.id_refs_serial += 1
         obj = self.find_object(id_ref)
         if obj:
             nodes = obj.node.xpath(".//%s" % attr_list_type)
@@ -2871,7 +3339,7 @@ class CibFactory(object):
 
     def mkobj_set(self, *args):
         if not args:
-            return True, copy.copy(self.cib_objects)
+            return True, list(self.cib_objects)
         if args[0] == "NOOBJ":
             return True, []
         rc = True
@@ -2942,8 +3410,11 @@ class CibFactory(object):
                            (obj_id, child_id))
                 rc = False
             c_dict[child_id] = 1
-        for other in [x for x in self.cib_objects
-                      if x != obj and is_container(x.node)]:
+        others = set()
+        for child in obj.children:
+            others.update(x for x in self._referrers_of(child.obj_id)
+                          if x != obj and is_container(x.node))
+        for other in [x for x in self.cib_objects if x in others]:
             shared_obj = set(obj.children) & set(other.children)
             if shared_obj:
                 common_err("%s contained in both %s and %s" %
@@ -3002,7 +3473,9 @@ class CibFactory(object):
     def set_property_cli(self, obj_type, node):
         pset_id = node.get('id') or default_id_for_obj(obj_type)
         obj = self.find_object(pset_id)
-        if not obj:
+        if obj:
+            self._touch(obj)
+        else:
             if not is_id_valid(pset_id):
                 invalid_id_err(pset_id)
                 return None
@@ -3014,7 +3487,7 @@ class CibFactory(object):
             obj.origin = "user"
             obj.node.set('id', pset_id)
             topnode.append(obj.node)
-            self.cib_objects.append(obj)
+            self._add_obj(obj)
         copy_nvpairs(obj.node, node)
         obj.set_updated()
         return obj
@@ -3033,6 +3506,7 @@ class CibFactory(object):
 
         # the given node is not postprocessed
         node, obj_type, obj_id = postprocess_cli(node, id_hint=rsc_obj.obj_id)
+        self._touch(rsc_obj)
 
         del node.attrib['rsc']
         return rsc_obj.add_operation(node)
@@ -3094,11 +3568,14 @@ class CibFactory(object):
             if newnode.getparent() is not None:
                 newnode.getparent().remove(newnode)
             return True  # the new and the old versions are equal
+        self._touch(obj)
         obj.node = newnode
         common_debug("update CIB element: %s" % str(obj))
         if oldnode.getparent() is not None:
             oldnode.getparent().replace(oldnode, newnode)
         obj.nocli = False  # try again after update
+        if obj.obj_type == "node":
+            self._reindex_obj(obj)
         if not self._adjust_children(obj):
             return False
         if not obj.cli_use_validate():
@@ -3110,11 +3587,14 @@ class CibFactory(object):
 
     def merge_from_cli(self, obj, node):
         common_debug("merge_from_cli: %s %s" % (obj.obj_type, etree.tostring(node)))
+        self._touch(obj)
         if obj.obj_type in constants.nvset_cli_names:
             rc = merge_attributes(obj.node, node, "nvpair")
         else:
             rc = merge_nodes(obj.node, node)
         if rc:
+            if obj.obj_type == "node":
+                self._reindex_obj(obj)
             obj.set_updated()
         return True
 
@@ -3235,6 +3715,8 @@ class CibFactory(object):
         old_children = [x for x in obj.children if x.parent == obj]
         new_children = [self.find_object(x) for x in new_children_ids]
         new_children = [c for c in new_children if c is not None]
+        for child in new_children:
+            self._touch(child)
         obj.children = new_children
         # relink orphans to top
         for child in set(old_children) - set(obj.children):
@@ -3247,7 +3729,8 @@ class CibFactory(object):
     def _relink_child_to_top(self, obj):
         'Relink a child to the top node.'
         get_topnode(self.cib_elem, obj.parent_type).append(obj.node)
-        obj.parent = None
+        parent, obj.parent = obj.parent, None
+        self.update_refs(parent)
 
     def _are_children_orphans(self, obj):
         """
@@ -3281,6 +3764,8 @@ class CibFactory(object):
             rmnode(oldnode)
             if child.parent:
                 child.parent.updated = True
+                if child.parent != obj:
+                    self.update_refs(child.parent)
             child.parent = obj
         return True
 
@@ -3327,7 +3812,7 @@ class CibFactory(object):
             obj.nocli = True
         self._update_links(obj)
         obj.origin = "user"
-        self.cib_objects.append(obj)
+        self._add_obj(obj)
         return obj
 
     def _add_children(self, obj_type, node):
@@ -3375,6 +3860,7 @@ class CibFactory(object):
     def _remove_obj(self, obj):
         "Remove a cib object."
         common_debug("remove object %s" % str(obj))
+        self._touch(obj)
         for child in obj.children:
             # just relink, don't remove children
             self._relink_child_to_top(child)
@@ -3383,14 +3869,16 @@ class CibFactory(object):
         idmgmt.remove_xml(obj.node)
         rmnode(obj.node)
         self._add_to_remove_queue(obj)
-        self.cib_objects.remove(obj)
+        self._del_obj(obj)
         for c_obj in self.related_constraints(obj):
+            self._touch(c_obj)
             if is_simpleconstraint(c_obj.node) and obj.children:
                 # the first child inherits constraints
                 rename_rscref(c_obj, obj.obj_id, obj.children[0].obj_id)
             deleted = False
             if delete_rscref(c_obj, obj.obj_id):
                 deleted = True
+            self.update_refs(c_obj)
             if silly_constraint(c_obj.node, obj.obj_id):
                 # remove invalid constraints
                 self._remove_obj(c_obj)
@@ -3404,13 +3892,14 @@ class CibFactory(object):
             return is_constraint(obj2.node) and rsc_constraint(obj.obj_id, obj2.node)
         if not is_resource(obj.node):
             return []
-        return [x for x in self.cib_objects if related_constraint(x)]
+        return [x for x in self._referrers_of(obj.obj_id) if related_constraint(x)]
 
     def related_elements(self, obj):
         "Both constraints, groups, tags, ..."
         if not is_resource(obj.node):
             return []
-        return [x for x in self.cib_objects if is_related(obj.obj_id, x.node)]
+        return [x for x in self._referrers_of(obj.obj_id)
+                if is_related(obj.obj_id, x.node)]
 
     def _redirect_children_constraints(self, obj):
         '''
@@ -3418,7 +3907,9 @@ class CibFactory(object):
         '''
         for child in obj.children:
             for c_obj in self.related_constraints(child):
+                self._touch(c_obj)
                 rename_rscref(c_obj, child.obj_id, obj.obj_id)
+                self.update_refs(c_obj)
         # drop useless constraints which may have been created above
         for c_obj in self.related_constraints(obj):
             if silly_constraint(c_obj.node, obj.obj_id):
@@ -3429,13 +3920,8 @@ class CibFactory(object):
     def template_primitives(self, obj):
         if not is_template(obj.node):
             return []
-        c_list = []
-        for obj2 in self.cib_objects:
-            if not is_primitive(obj2.node):
-                continue
-            if obj2.node.get("template") == obj.obj_id:
-                c_list.append(obj2)
-        return c_list
+        return [x for x in self._referrers_of(obj.obj_id)
+                if is_primitive(x.node) and x.node.get("template") == obj.obj_id]
 
     def _check_running_primitives(self, prim_l):
         rscstat = RscState()
@@ -3456,7 +3942,7 @@ class CibFactory(object):
         '''
         if obj.parent and len(obj.parent.children) == 1:
             self._delete_1(obj.parent)
-        if obj in self.cib_objects:  # don't remove parents twice
+        if obj in self._obj_pos:  # don't remove parents twice
             self._remove_obj(obj)
 
     def delete(self, *args):
@@ -3522,10 +4008,15 @@ class CibFactory(object):
             return False
         if not obj.can_be_renamed():
             return False
+        self._touch(obj)
         for c_obj in self.related_constraints(obj):
+            self._touch(c_obj)
             rename_rscref(c_obj, old_id, new_id)
+            self.update_refs(c_obj)
         rename_id(obj.node, old_id, new_id)
+        self._unindex_obj(obj)
         obj.obj_id = new_id
+        self._index_obj(obj)
         idmgmt.rename(old_id, new_id)
         # FIXME: (bnc#901543)
         # for each child node; if id starts with "%(old_id)s-" and
@@ -3566,7 +4057,8 @@ class CibFactory(object):
             for obj in self.cib_objects:
                 if obj.obj_type != "node":
                     print >> sys.stderr, str(obj)
-            self.cib_objects = []
+            self.cib_objects = oset()
+            self._rebuild_index()
         return True
 
     def erase_nodes(self):
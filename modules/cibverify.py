@@ -33,7 +33,13 @@ def _prettify(line, indent=0):
 
 
 def verify(cib):
-    rc, _, stderr = utils.get_stdout_stderr(cib_verify, cib)
+    """
+    Run crm_verify on cib, a string or an iterable of strings
+    (piped as produced). Errors go to err_buf. Returns rc.
+    """
+    if isinstance(cib, basestring):
+        cib = [cib]
+    rc, _, stderr = utils.pipe_strings(cib_verify, cib, capture=True)
     for i, line in enumerate(line for line in stderr.split('\n') if line):
         if i == 0:
             err_buf.error(_prettify(line, 0))
@@ -37,15 +37,18 @@ def disable_pretty():
 
 
 class nopretty(object):
+    "Turn pretty off for a block. Nested blocks are fine."
     def __init__(self, cond=True):
         self.cond = cond
+        self.saved = None
 
     def __enter__(self):
         if self.cond:
+            self.saved = _pretty
             disable_pretty()
 
     def __exit__(self, type, value, traceback):
-        if self.cond:
+        if self.cond and self.saved:
             enable_pretty()
 
 
@@ -472,7 +472,7 @@ class ChildInfo(object):
     methods.
 
     The rest of the parameters are the actual arguments to the method. These
-    are tokenized using shlex and then matched to the actual arguments of the
+    are tokenized like shlex does and then matched to the actual arguments of the
     method.
 
     Information about a child node in the hierarchy:
@@ -218,6 +218,8 @@ DEFAULTS = {
         'dot': opt_program('', ('dot',)),
         'supported_schemas': opt_list(_SUPPORTED_SCHEMAS),
         'ignore_missing_metadata': opt_boolean('no'),
+        'cib_diff': opt_choice('native', ('native', 'crm_diff', 'verify')),
+        'profile': opt_boolean('no'),
     },
     'path': {
         'sharedir': opt_dir('%(datadir)s/crmsh'),
@@ -272,8 +274,10 @@ class _Configuration(object):
         self._defaults = None
         self._systemwide = None
         self._user = None
+        self.serial = 0  # bumped on every change
 
     def load(self):
+        self.serial += 1
         self._defaults = ConfigParser.SafeConfigParser()
         for section, keys in DEFAULTS.iteritems():
             self._defaults.add_section(section)
@@ -325,6 +329,7 @@ class _Configuration(object):
         if not self._user.has_section(section):
             self._user.add_section(section)
         self._user.set(section, name, _stringify(value))
+        self.serial += 1
 
     def items(self, section):
         return [(k, self.get(section, k)) for k, _ in self._defaults.items(section)]
@@ -341,6 +346,7 @@ class _Configuration(object):
         '''reset to what is on disk'''
         self._user = ConfigParser.SafeConfigParser()
         self._user.read([_PERUSER])
+        self.serial += 1
 
 
 _configuration = _Configuration()
@@ -403,6 +409,14 @@ def get_configured_options():
     return ret
 
 
+def serial():
+    '''
+    A number which changes whenever the configuration
+    changes. Used to invalidate cached output.
+    '''
+    return _configuration.serial
+
+
 def complete(section, option):
     s = DEFAULTS.get(section)
     if not s:
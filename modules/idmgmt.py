@@ -16,7 +16,6 @@
 #
 
 from . import constants
-import copy
 from .msg import common_error, id_used_err
 from . import xmlutil
 
@@ -25,28 +24,39 @@ from . import xmlutil
 Make sure that ids are unique.
 '''
 _id_store = {}
-_state = []
+_state = []  # undo journals: lists of (id, was it in use)
 ok = True  # error var
 
 
+def _journal(node_id):
+    if _state:
+        _state[-1].append((node_id, node_id in _id_store))
+
+
 def push_state():
-    _state.append(copy.deepcopy(_id_store))
+    _state.append([])
 
 
 def pop_state():
     try:
-        global _id_store
-        _id_store = _state.pop()
-        return True
+        journal = _state.pop()
     except IndexError:
         return False
+    for node_id, was_used in reversed(journal):
+        if was_used:
+            _id_store[node_id] = 1
+        else:
+            _id_store.pop(node_id, None)
+    return True
 
 
 def drop_state():
     try:
-        _state.pop()
-    except KeyError:
-        pass
+        journal = _state.pop()
+    except IndexError:
+        return
+    if _state:
+        _state[-1].extend(journal)
 
 
 def clean_state():
@@ -149,6 +159,8 @@ def id_in_use(obj_id):
 def save(node_id):
     if not node_id:
         return
+    if node_id not in _id_store:
+        _journal(node_id)
     _id_store[node_id] = 1
 
 
@@ -166,10 +178,9 @@ def rename(old_id, new_id):
 def remove(node_id):
     if not node_id:
         return
-    try:
+    if node_id in _id_store:
+        _journal(node_id)
         del _id_store[node_id]
-    except KeyError:
-        pass
 
 
 def clear():
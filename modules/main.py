@@ -139,6 +139,9 @@ See the crm(8) man page or call %prog help for more details.""",
     parser.add_option("--scriptdir", dest="scriptdir", metavar="DIR",
                       help="Extra directory where crm looks for cluster scripts. Can be " +
                       "a semicolon-separated list of directories.")
+    parser.add_option("--profile", action="store_true", default=False, dest="cprofile",
+                      help="Profile each command, save the profiles in the cache " +
+                      "directory and print the functions where most time was spent.")
     parser.add_option("-X", dest="profile", metavar="PROFILE",
                       help="Collect profiling data and save in PROFILE.")
     return parser
@@ -314,6 +317,7 @@ def parse_options():
     options.regression_tests = opts.regression_tests or options.regression_tests
     config.color.style = opts.display or config.color.style
     config.core.force = opts.force or config.core.force
+    config.core.profile = "yes" if opts.cprofile else config.core.profile
     if opts.filename:
         err_buf.reset_lineno()
         options.input_file, options.batch, options.interactive = opts.filename, True, False
@@ -38,6 +38,7 @@ class ErrorBuffer(object):
         self.mode = "immediate"
         self.lineno = -1
         self.written = {}
+        self.recorded = None  # (level, message) list, see record()
 
     def buffer(self):
         self.mode = "keep"
@@ -56,6 +57,23 @@ class ErrorBuffer(object):
             self.msg_list = []
         self.mode = "immediate"
 
+    def record(self):
+        '''
+        Keep the messages as (level, message) in recorded instead
+        of showing them, to be replayed (e.g. in another process).
+        '''
+        self.recorded = []
+
+    def replay(self, l):
+        for level, s in l:
+            getattr(self, level)(s)
+
+    def _record(self, level, s):
+        if self.recorded is None:
+            return False
+        self.recorded.append((level, s))
+        return True
+
     def writemsg(self, msg, to=None):
         if to is None:
             to = ERR_STREAM
@@ -93,25 +111,31 @@ class ErrorBuffer(object):
         self.writemsg(self._render("%s: %s" % (pfx, self.add_lineno(s))), to=to)
 
     def ok(self, s):
-        self._prefix(clidisplay.ok("OK"), s, to=sys.stdout)
+        if not self._record("ok", s):
+            self._prefix(clidisplay.ok("OK"), s, to=sys.stdout)
 
     def error(self, s):
-        self._prefix(clidisplay.error("ERROR"), s)
+        if not self._record("error", s):
+            self._prefix(clidisplay.error("ERROR"), s)
 
     def warning(self, s):
-        self._prefix(clidisplay.warn("WARNING"), s)
+        if not self._record("warning", s):
+            self._prefix(clidisplay.warn("WARNING"), s)
 
     def one_warning(self, s):
+        if self._record("one_warning", s):
+            return
         if s not in self.written:
             self.written[s] = 1
             self.writemsg(self._render(clidisplay.warn("WARNING")) + ": %s" %
                           self.add_lineno(s))
 
     def info(self, s):
-        self._prefix(clidisplay.info("INFO"), s)
+        if not self._record("info", s):
+            self._prefix(clidisplay.info("INFO"), s)
 
     def debug(self, s):
-        if config.core.debug:
+        if config.core.debug and not self._record("debug", s):
             self._prefix("DEBUG", s)
 
     def _render(self, s):
@@ -15,15 +15,17 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-import shlex
 import re
+import multiprocessing
 from lxml import etree
 from . import constants
 from .ra import disambiguate_ra_type, ra_type_validate
+from .ra import ra_providers, prefetch_providers
+from . import cache
 from . import schema
 from .utils import keyword_cmp, verify_boolean, lines2cli
-from .utils import get_boolean, olist, canonical_boolean
-from .msg import common_err, syntax_err
+from .utils import get_boolean, olist, canonical_boolean, tokenize
+from .msg import common_err, syntax_err, err_buf
 from . import xmlbuilder
 from . import xmlutil
 
@@ -326,6 +328,8 @@ class RuleParser(BaseParser):
     _BOOLOP_RE = re.compile(r'(%s)$' % ('|'.join(constants.boolean_ops)), re.IGNORECASE)
     _UNARYOP_RE = re.compile(r'(%s)$' % ('|'.join(constants.unary_ops)), re.IGNORECASE)
     _BINOP_RE = None
+    _SCORE_VALUE_RE = re.compile(r'^[+-]?(inf(inity)?|INF(INITY)?|[0-9]+)$')
+    _INFINITY_RE = re.compile(r'inf(inity)?|INF(INITY)?')
 
     _TERMINATORS = ('params', 'meta', 'utilization', 'operations', 'op', 'rule')
 
@@ -509,8 +513,8 @@ class RuleParser(BaseParser):
     def validate_score(self, score, noattr=False):
         if not noattr and score in olist(constants.score_types):
             return constants.score_types[score.lower()]
-        elif re.match("^[+-]?(inf(inity)?|INF(INITY)?|[0-9]+)$", score):
-            score = re.sub("inf(inity)?|INF(INITY)?", "INFINITY", score)
+        elif self._SCORE_VALUE_RE.match(score):
+            score = self._INFINITY_RE.sub("INFINITY", score)
             return ["score", score]
         if noattr:
             # orders have the special kind attribute
@@ -1591,7 +1595,7 @@ class CliParser(object):
             if s.startswith('xml'):
                 s = self._xml_lex(s)
             else:
-                s = shlex.split(s)
+                s = tokenize(s)
         # but there shouldn't be any newlines (?)
         while '\n' in s:
             s.remove('\n')
@@ -1625,4 +1629,106 @@ class CliParser(object):
         syntax_err(s, token=s[0], msg="Unknown command")
         return False
 
+
+# statements per job when parsing in parallel
+parse_chunk_size = 1000
+
+
+def _ocf_types(statements):
+    '''
+    Types of the ocf agents whose provider has to be looked up
+    to parse the primitives and templates in statements.
+    '''
+    types = set()
+    for cli_text in statements:
+        l = cli_text.split(None, 3) if cli_text else []
+        if len(l) < 3 or l[0].lower() not in ("primitive", "rsc_template"):
+            continue
+        c_t = l[2].split(':')
+        if len(c_t) == 1 and not c_t[0].startswith('@'):
+            types.add(c_t[0])
+        elif len(c_t) == 2 and c_t[0] == "ocf":
+            types.add(c_t[1])
+    return types
+
+
+def _init_worker(providers):
+    "Seed the providers cache of a pool worker."
+    for ra_type, l in providers.iteritems():
+        cache.store("ra_providers", "ocf:%s" % ra_type, l)
+
+
+def _parse_chunk(statements):
+    '''
+    Parse statements in a pool worker. Returns a list of
+    (xml or False or None, messages) for each statement, the
+    messages as recorded by err_buf.
+    '''
+    cp = CliParser()
+    out = []
+    for cli_text in statements:
+        err_buf.record()
+        node = cp.parse(cli_text) if cli_text is not None else None
+        if node not in (False, None):
+            node = etree.tostring(node)
+        out.append((node, err_buf.recorded))
+    err_buf.recorded = None
+    return out
+
+
+def _chunks(statements, chunk_size):
+    "Split statements so that comments stay with the next statement."
+    start = 0
+    while start < len(statements):
+        end = start + chunk_size
+        while end < len(statements) and (statements[end - 1] or '').startswith('#'):
+            end += 1
+        yield statements[start:end]
+        start = end
+
+
+def parse_statements(statements, jobs=None, chunk_size=None):
+    '''
+    Parse a list of CLI statements, such as returned by
+    lines2cli(). Generates what CliParser.parse() returns for
+    each statement, in order, and increments the error buffer
+    line number as it goes. Statements which are None are not
+    parsed and give None. More than chunk_size statements are
+    parsed on a pool of at most jobs processes (by default,
+    parse_chunk_size and the number of CPUs). The RA providers
+    are looked up once, here, and handed to the workers. Their
+    messages are replayed here, as each statement is reached.
+    '''
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if chunk_size is None:
+        chunk_size = parse_chunk_size
+    pool = None
+    if len(statements) > chunk_size and jobs > 1:
+        types = _ocf_types(statements)
+        prefetch_providers(types)
+        providers = dict((t, ra_providers(t)) for t in types)
+        try:
+            pool = multiprocessing.Pool(min(jobs, len(statements) / chunk_size + 1),
+                                        _init_worker, (providers,))
+        except OSError:
+            pool = None
+    if pool is None:
+        cp = CliParser()
+        for cli_text in statements:
+            err_buf.incr_lineno()
+            yield cp.parse(cli_text) if cli_text is not None else None
+        return
+    try:
+        for results in pool.imap(_parse_chunk, _chunks(statements, chunk_size)):
+            for node, msgs in results:
+                err_buf.incr_lineno()
+                err_buf.replay(msgs)
+                if node not in (False, None):
+                    node = etree.fromstring(node)
+                yield node
+    finally:
+        pool.terminate()
+        pool.join()
+
 # vim:ts=4:sw=4:et:
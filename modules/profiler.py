@@ -0,0 +1,132 @@
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+'''
+Per-command profiling.
+
+With crm --profile or the profile option set, every command is
+run under cProfile. The profile is saved in the profile directory
+under the cache directory, one file per command (readable with
+pstats), replaced the next time the command runs. The functions
+with the most cumulative time are listed on stderr. At exit, the
+time spent in each command is summarized by level and command.
+'''
+
+import os
+import sys
+import time
+import atexit
+from . import config
+from .msg import common_debug
+
+# number of functions listed after each command
+top = 15
+
+_totals = {}
+
+
+def enabled():
+    return config.core.profile
+
+
+def profile_dir():
+    return os.path.join(config.path.cache, "profile")
+
+
+def _profile_path(name):
+    return os.path.join(profile_dir(), "%s.prof" % name)
+
+
+def _save(prof, name):
+    '''
+    Save profile to the profile directory. Returns the file
+    name or None.
+    '''
+    path = _profile_path(name)
+    try:
+        if not os.path.isdir(profile_dir()):
+            os.makedirs(profile_dir())
+        prof.dump_stats(path)
+    except (IOError, OSError), msg:
+        common_debug("cannot save profile %s: %s" % (path, msg))
+        return None
+    return path
+
+
+def _account(name, elapsed):
+    st = _totals.setdefault(name, [0, 0.0])
+    st[0] += 1
+    st[1] += elapsed
+
+
+def _print_top(prof, name, elapsed, path, f):
+    import pstats
+    print >> f, "profile: %s: %.3fs%s" % (name, elapsed, path and (" (%s)" % path) or "")
+    stats = pstats.Stats(prof, stream=f)
+    stats.sort_stats("cumulative").print_stats(top)
+
+
+def run(name, fn, *args):
+    '''
+    Call fn(*args) under the profiler on behalf of command
+    name (level.command).
+    '''
+    import cProfile
+    prof = cProfile.Profile()
+    started = time.time()
+    try:
+        return prof.runcall(fn, *args)
+    finally:
+        elapsed = time.time() - started
+        _account(name, elapsed)
+        _print_top(prof, name, elapsed, _save(prof, name), sys.stderr)
+
+
+def summary():
+    '''
+    List of (level or command, calls, total time), levels
+    before their commands, most time consuming first.
+    '''
+    levels = {}
+    for name, (calls, total) in _totals.iteritems():
+        level = name.rsplit('.', 1)[0] if '.' in name else ''
+        st = levels.setdefault(level, [level or '(top)', 0, 0.0, []])
+        st[1] += calls
+        st[2] += total
+        st[3].append((name, calls, total))
+    l = []
+    for level, calls, total, cmds in sorted(levels.values(), key=lambda st: -st[2]):
+        l.append((level, calls, total))
+        l.extend(sorted(cmds, key=lambda st: -st[2]))
+    return l
+
+
+def _print_summary(f):
+    fmt = "%-30s %6s %10s"
+    print >> f, fmt % ("level/command", "calls", "total(s)")
+    for name, calls, total in summary():
+        if name in _totals:
+            name = "  " + name
+        print >> f, fmt % (name, calls, "%.3f" % total)
+
+
+def _exit_handler():
+    "Called at program exit"
+    if _totals:
+        _print_summary(sys.stderr)
+
+
+atexit.register(_exit_handler)
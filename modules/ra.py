@@ -21,6 +21,10 @@ import copy
 from lxml import etree
 import re
 import glob
+import json
+import tempfile
+import shutil
+from multiprocessing.pool import ThreadPool
 from . import cache
 from . import constants
 from . import config
@@ -31,12 +35,26 @@ from .utils import stdout2list, is_program, is_process, add_sudo
 from .utils import os_types_list, get_stdout, find_value
 from .utils import crm_msec, crm_time_cmp
 from .msg import common_debug, common_err, common_warn, common_info
+from .ordereddict import odict
 
 #
 # Resource Agents interface (meta-data, parameters, etc)
 #
 lrmadmin_prog = "lrmadmin"
 
+# at most that many agents are run at the same time
+prefetch_threads = 8
+
+# agent lists may change when packages get installed, the
+# meta-data rarely does
+cache.namespace("ra_classes", max_entries=1)
+cache.namespace("ra_providers_all", max_entries=16)
+cache.namespace("ra_providers")
+cache.namespace("ra_types", max_entries=64)
+cache.namespace("ra_params", ttl=3600, max_entries=200)
+cache.namespace("ra_actions", ttl=3600, max_entries=200)
+cache.namespace("ra_schema", ttl=3600, max_entries=200)
+
 
 class RaLrmd(object):
     '''
@@ -101,11 +119,31 @@ class RaOS(object):
         l = []
         if ra_class == "ocf":
             for s in glob.glob("%s/resource.d/*/%s" % (os.environ["OCF_ROOT"], ra_type)):
-                a = s.split("/")
-                if len(a) == 7:
-                    l.append(a[5])
+                l.append(os.path.basename(os.path.dirname(s)))
         return l
 
+    def providers_map(self, ra_class="ocf"):
+        '''
+        Dict of type -> list of providers, from one pass over
+        resource.d.
+        '''
+        d = {}
+        if ra_class != "ocf":
+            return d
+        ocf = os.path.join(os.environ["OCF_ROOT"], "resource.d")
+        try:
+            provs = os.listdir(ocf)
+        except OSError:
+            return d
+        for prov in provs:
+            try:
+                types = os.listdir(os.path.join(ocf, prov))
+            except OSError:
+                continue
+            for ra_type in types:
+                d.setdefault(ra_type, []).append(prov)
+        return d
+
     def classes(self):
         'List of classes.'
         return "heartbeat lsb nagios ocf stonith systemd".split()
@@ -234,54 +272,243 @@ def ra_classes():
     '''
     List of RA classes.
     '''
-    if cache.is_cached("ra_classes"):
-        return cache.retrieve("ra_classes")
+    l = cache.retrieve("ra_classes", "")
+    if l is not None:
+        return l
     l = ra_if().classes()
     l.sort()
-    return cache.store("ra_classes", l)
+    return cache.store("ra_classes", "", l)
 
 
 def ra_providers(ra_type, ra_class="ocf"):
     'List of providers for a class:type.'
-    id = "ra_providers-%s-%s" % (ra_class, ra_type)
-    if cache.is_cached(id):
-        return cache.retrieve(id)
+    id = "%s:%s" % (ra_class, ra_type)
+    l = cache.retrieve("ra_providers", id)
+    if l is not None:
+        return l
     l = ra_if().providers(ra_type, ra_class)
     l.sort()
-    return cache.store(id, l)
+    return cache.store("ra_providers", id, l)
 
 
 def ra_providers_all(ra_class="ocf"):
     '''
     List of providers for a class.
     '''
-    id = "ra_providers_all-%s" % ra_class
-    if cache.is_cached(id):
-        return cache.retrieve(id)
+    l = cache.retrieve("ra_providers_all", ra_class)
+    if l is not None:
+        return l
     ocf = os.path.join(os.environ["OCF_ROOT"], "resource.d")
     if os.path.isdir(ocf):
-        return cache.store(id, sorted([s for s in os.listdir(ocf)
-                                       if os.path.isdir(os.path.join(ocf, s))]))
+        return cache.store("ra_providers_all", ra_class,
+                           sorted([s for s in os.listdir(ocf)
+                                   if os.path.isdir(os.path.join(ocf, s))]))
     return []
 
 
+def _run_parallel(fn, items):
+    '''
+    Call fn for each item, running at most prefetch_threads
+    at the same time.
+    '''
+    if len(items) < 2:
+        for item in items:
+            fn(item)
+        return
+    ra_if()  # settle on the interface before the threads do
+    pool = ThreadPool(min(prefetch_threads, len(items)))
+    try:
+        pool.map(fn, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def prefetch_providers(ra_types, ra_class="ocf"):
+    '''
+    Get the providers of all types into the cache. Directly
+    from resource.d if possible, otherwise concurrently.
+    '''
+    todo = [t for t in set(ra_types)
+            if cache.retrieve("ra_providers", "%s:%s" % (ra_class, t)) is None]
+    if not todo:
+        return
+    ra = ra_if()
+    if isinstance(ra, RaOS):
+        d = ra.providers_map(ra_class)
+        for t in todo:
+            cache.store("ra_providers", "%s:%s" % (ra_class, t), sorted(d.get(t, [])))
+    else:
+        _run_parallel(lambda t: ra_providers(t, ra_class), todo)
+
+
+def prefetch_meta(agents):
+    '''
+    Get the parsed meta-data of all agents (RAInfo instances)
+    into the cache, running the agents concurrently.
+    '''
+    todo = odict()
+    for agent in agents:
+        key = agent.ra_string()
+        if key not in todo and cache.retrieve("ra_schema", key) is None:
+            todo[key] = agent
+    _run_parallel(lambda agent: agent.mk_ra_node(), todo.values())
+
+
 def ra_types(ra_class="ocf", ra_provider=""):
     '''
     List of RA type for a class.
     '''
     if not ra_class:
         ra_class = "ocf"
-    id = "ra_types-%s-%s" % (ra_class, ra_provider)
-    if cache.is_cached(id):
-        return cache.retrieve(id)
+    id = "%s:%s" % (ra_class, ra_provider)
+    list = cache.retrieve("ra_types", id)
+    if list is not None:
+        return list
     list = []
-    for ra in ra_if().types(ra_class):
+    types = ra_if().types(ra_class)
+    if ra_provider:
+        prefetch_providers(types, ra_class)
+    for ra in types:
         if (not ra_provider or
                 ra_provider in ra_providers(ra, ra_class)) \
                 and ra not in list:
             list.append(ra)
     list.sort()
-    return cache.store(id, list)
+    return cache.store("ra_types", id, list)
+
+
+def _agent_path(ra_class, ra_type, ra_provider):
+    "Executable which produces the meta-data, if known."
+    if ra_class in constants.meta_progs:
+        return is_program(ra_class)
+    if ra_class == "ocf":
+        return os.path.join(os.environ["OCF_ROOT"], "resource.d", ra_provider, ra_type)
+    if ra_class == "stonith" and ra_type.startswith("fence_"):
+        return "/usr/sbin/%s" % ra_type
+    if ra_class == "lsb":
+        return "/etc/init.d/%s" % ra_type
+    if ra_class == "nagios":
+        return os.path.join(config.path.nagios_plugins, "check_%s" % ra_type)
+    return None
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, int(st.st_mtime), st.st_size]
+
+
+@utils.memoize
+def _pcmk_stamp():
+    """
+    Identifies the installed pacemaker without running any of
+    its programs.
+    """
+    for prog in ("crmd", "crm_resource"):
+        path = is_program(prog)
+        if path:
+            return _file_stamp(path)
+    return None
+
+
+def _to_str(o):
+    "json gives us unicode, the rest of the code expects str."
+    if isinstance(o, unicode):
+        return o.encode('utf-8')
+    if isinstance(o, list):
+        return [_to_str(x) for x in o]
+    if isinstance(o, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in o.iteritems())
+    return o
+
+
+def _meta_store_dir():
+    return os.path.join(config.path.cache, "ra")
+
+
+class RaMetaStore(object):
+    '''
+    Meta-data of an agent, as well as params and actions parsed
+    from it, kept on disk so that other crm processes don't need
+    to run the agent again. An entry is valid only as long as
+    the agent executable and pacemaker stay the same. Entries
+    are replaced by rename, so concurrent readers always see a
+    complete file.
+    '''
+    def __init__(self, ra_class, ra_type, ra_provider, ra_string):
+        self.path = os.path.join(_meta_store_dir(), ra_string.replace("/", "%"))
+        agent = _agent_path(ra_class, ra_type, ra_provider)
+        self.stamp = None
+        if agent:
+            agent_stamp = _file_stamp(agent)
+            if agent_stamp:
+                self.stamp = [agent_stamp, _pcmk_stamp()]
+        self.entry = None
+
+    def _load(self):
+        if self.entry is not None:
+            return self.entry
+        self.entry = {}
+        if self.stamp is None:
+            return self.entry
+        try:
+            f = open(self.path)
+            try:
+                d = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return self.entry
+        if isinstance(d, dict) and d.get("stamp") == self.stamp:
+            self.entry = _to_str(d)
+        return self.entry
+
+    def get(self, what):
+        return self._load().get(what)
+
+    def put(self, entry):
+        "Save the entry (meta, params and actions) in one go."
+        if self.stamp is None:
+            return
+        entry = dict(entry, stamp=self.stamp)
+        d = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix=".")
+            try:
+                f = os.fdopen(fd, "w")
+                try:
+                    json.dump(entry, f)
+                finally:
+                    f.close()
+                os.rename(tmp, self.path)
+            finally:
+                if os.path.exists(tmp):
+                    try:
+                        os.unlink(tmp)
+                    except (OSError, IOError):
+                        pass
+        except (IOError, OSError, TypeError, ValueError), msg:
+            common_debug("%s: cannot save meta-data: %s" % (self.path, msg))
+            return
+        self.entry = entry
+
+
+def clear_meta_store():
+    "Remove the meta-data kept on disk."
+    d = _meta_store_dir()
+    if not os.path.isdir(d):
+        return True
+    try:
+        shutil.rmtree(d)
+    except (OSError, IOError), msg:
+        common_err("cannot remove %s: %s" % (d, msg))
+        return False
+    return True
 
 
 @utils.memoize
@@ -361,6 +588,75 @@ def monitor_name_pl(pl):
     return mk_monitor_name(role, depth)
 
 
+class RaParam(object):
+    "A parameter from the meta-data."
+    __slots__ = ("name", "required", "unique", "type", "default",
+                 "shortdesc", "longdesc")
+
+    def __init__(self, n):
+        self.name = n.get("name")
+        self.required = n.get("required")
+        self.unique = n.get("unique")
+        content = n.find("content")
+        if content is not None:
+            self.type = content.get("type")
+            self.default = content.get("default")
+        else:
+            self.type = self.default = None
+        self.shortdesc = get_nodes_text(n, "shortdesc")
+        self.longdesc = get_nodes_text(n, "longdesc")
+
+
+class RaAction(object):
+    "An action from the meta-data."
+    __slots__ = ("name", "key", "attrs")
+
+    def __init__(self, n):
+        self.name = n.get("name")
+        # monitors are told apart by role and depth
+        self.key = self.name == "monitor" and monitor_name_node(n) or self.name
+        self.attrs = tuple(n.attrib.items())
+
+
+class RaSchema(object):
+    '''
+    The meta-data of an agent, parsed once. Parameters are
+    looked up by name in param_index; if a name repeats, the
+    last one wins.
+    '''
+    __slots__ = ("name", "shortdesc", "longdesc", "params", "param_index",
+                 "required", "unique", "actions")
+
+    def __init__(self, elem=None):
+        if elem is None:
+            return
+        self.name = elem.get("name")
+        self.shortdesc = get_nodes_text(elem, "shortdesc")
+        self.longdesc = get_nodes_text(elem, "longdesc")
+        self._set_params([RaParam(c) for c in elem.xpath("//parameters/parameter")
+                          if c.get("name")])
+        self.actions = tuple(RaAction(c) for c in elem.xpath("//actions/action")
+                             if c.get("name"))
+
+    def _set_params(self, params):
+        self.params = tuple(params)
+        self.param_index = dict((p.name, i) for i, p in enumerate(self.params))
+        self.required = frozenset(p.name for p in self.params if p.required == "1")
+        self.unique = frozenset(p.name for p in self.params if p.unique == "1")
+
+    def param(self, name):
+        i = self.param_index.get(name)
+        return i is not None and self.params[i] or None
+
+    def with_params(self, other):
+        "A copy with the parameters of the other schema added."
+        schema = RaSchema()
+        for attr in ("name", "shortdesc", "longdesc", "actions"):
+            setattr(schema, attr, getattr(self, attr))
+        schema._set_params(self.params + other.params)
+        return schema
+
+
 class RAInfo(object):
     '''
     A resource agent and whatever's useful about it.
@@ -377,14 +673,41 @@ class RAInfo(object):
         self.ra_provider = ra_provider
         if ra_class == 'ocf' and not self.ra_provider:
             self.ra_provider = "heartbeat"
-        self.ra_elem = None
+        self.schema = None
         self.broken_ra = False
+        self._store = None
 
     def ra_string(self):
         return self.ra_class == "ocf" and \
             "%s:%s:%s" % (self.ra_class, self.ra_provider, self.ra_type) or \
             "%s:%s" % (self.ra_class, self.ra_type)
 
+    def meta_store(self):
+        if self._store is None:
+            self._store = RaMetaStore(self.ra_class, self.ra_type,
+                                      self.ra_provider, self.ra_string())
+        return self._store
+
+    def _stored(self, what):
+        """
+        params and actions of the meta programs are extended
+        with other meta-data (see get_properties_meta), so these
+        are not kept on disk.
+        """
+        if self.ra_class in constants.meta_progs:
+            return None
+        return self.meta_store().get(what)
+
+    def _keep(self, meta):
+        "Save meta-data, params and actions on disk."
+        if self.ra_class in constants.meta_progs or self.meta_store().get("params") is not None:
+            return
+        self.meta_store().put({
+            "meta": meta,
+            "params": self._params(),
+            "actions": self._actions(),
+        })
+
     def error(self, s):
         common_err("%s: %s" % (self.ra_string(), s))
 
@@ -413,26 +736,25 @@ class RAInfo(object):
                 return
         except:
             return
-        try:
-            params_node = self.ra_elem.findall("parameters")[0]
-        except:
-            params_node = etree.SubElement(self.ra_elem, "parameters")
-        for n in ra.ra_elem.xpath("//parameters/parameter"):
-            params_node.append(copy.deepcopy(n))
+        self.schema = self.schema.with_params(ra.schema)
 
     def mk_ra_node(self):
         '''
-        Return the resource_agent node.
+        Return the parsed meta-data (RaSchema). The XML is not
+        kept.
         '''
-        if self.ra_elem is not None:
-            return self.ra_elem
+        if self.schema is not None:
+            return self.schema
         # don't try again in vain
         if self.broken_ra:
             return None
+        self.schema = cache.retrieve("ra_schema", self.ra_string())
+        if self.schema is not None:
+            return self.schema
         self.broken_ra = True
         meta = self.meta()
         try:
-            self.ra_elem = etree.fromstring('\n'.join(meta))
+            elem = etree.fromstring('\n'.join(meta))
         except Exception:
             if not meta:
                 if not config.core.ignore_missing_metadata:
@@ -440,50 +762,42 @@ class RAInfo(object):
             else:
                 self.error("meta-data is no good XML")
             return None
-        try:
-            assert self.ra_elem.tag == 'resource-agent'
-        except Exception:
+        if elem.tag != 'resource-agent':
             self.error("meta-data contains no resource-agent element")
             return None
+        self.schema = RaSchema(elem)
         if self.ra_class == "stonith":
             self.add_ra_params(get_stonithd_meta())
         self.broken_ra = False
-        return self.ra_elem
-
-    def param_type_default(self, n):
-        try:
-            content = n.find("content")
-            type = content.get("type")
-            default = content.get("default")
-            return type, default
-        except:
-            return None, None
+        self._keep(meta)
+        return cache.store("ra_schema", self.ra_string(), self.schema)
 
     def params(self):
         '''
         Construct a dict of dicts: parameters are keys and
         dictionary of attributes/values are values. Cached too.
         '''
-        id = "ra_params-%s" % self.ra_string()
-        if cache.is_cached(id):
-            return cache.retrieve(id)
+        d = cache.retrieve("ra_params", self.ra_string())
+        if d is not None:
+            return d
+        d = self._stored("params")
+        if d is not None:
+            return cache.store("ra_params", self.ra_string(), d)
         if self.mk_ra_node() is None:
             return None
+        return cache.store("ra_params", self.ra_string(), self._params())
+
+    def _params(self):
+        "params() from the schema"
         d = {}
-        for c in self.ra_elem.xpath("//parameters/parameter"):
-            name = c.get("name")
-            if not name:
-                continue
-            required = c.get("required")
-            unique = c.get("unique")
-            type, default = self.param_type_default(c)
-            d[name] = {
-                "required": required,
-                "unique": unique,
-                "type": type,
-                "default": default,
+        for p in self.schema.params:
+            d[p.name] = {
+                "required": p.required,
+                "unique": p.unique,
+                "type": p.type,
+                "default": p.default,
             }
-        return cache.store(id, d)
+        return d
 
     def completion_params(self):
         '''
@@ -492,35 +806,32 @@ class RAInfo(object):
         '''
         if self.mk_ra_node() is None:
             return None
-        return [c.get("name")
-                for c in self.ra_elem.xpath("//parameters/parameter")
-                if c.get("name")
-                and c.get("name") not in self.excluded_from_completion]
+        return [p.name for p in self.schema.params
+                if p.name not in self.excluded_from_completion]
 
     def actions(self):
         '''
         Construct a dict of dicts: actions are keys and
         dictionary of attributes/values are values. Cached too.
         '''
-        id = "ra_actions-%s" % self.ra_string()
-        if cache.is_cached(id):
-            return cache.retrieve(id)
+        d = cache.retrieve("ra_actions", self.ra_string())
+        if d is not None:
+            return d
+        d = self._stored("actions")
+        if d is not None:
+            return cache.store("ra_actions", self.ra_string(), d)
         if self.mk_ra_node() is None:
             return None
+        return cache.store("ra_actions", self.ra_string(), self._actions())
+
+    def _actions(self):
+        "actions() from the schema"
         d = {}
-        for c in self.ra_elem.xpath("//actions/action"):
-            name = c.get("name")
-            if not name or name in self.skip_ops:
+        for action in self.schema.actions:
+            if action.name in self.skip_ops:
                 continue
-            if name == "monitor":
-                name = monitor_name_node(c)
-            d[name] = {}
-            for a in c.attrib.keys():
-                if a in self.skip_op_attr:
-                    continue
-                v = c.get(a)
-                if v:
-                    d[name][a] = v
+            d[action.key] = dict((a, v) for a, v in action.attrs
+                                 if v and a not in self.skip_op_attr)
         # add monitor ops without role, if they don't already
         # exist
         d2 = {}
@@ -530,7 +841,7 @@ class RAInfo(object):
                 if norole_op not in d:
                     d2[norole_op] = d[op]
         d.update(d2)
-        return cache.store(id, d)
+        return d
 
     def reqd_params_list(self):
         '''
@@ -577,6 +888,7 @@ class RAInfo(object):
         for nvp in nvpairs:
             if 'name' in nvp.attrib and 'value' in nvp.attrib:
                 d[nvp.get('name')] = nvp.get('value')
+        params = self.params() or {}
         if not existence_only:
             for p in self.reqd_params_list():
                 if self.unreq_param(p):
@@ -588,7 +900,7 @@ class RAInfo(object):
             if p.startswith("$"):
                 # these are special, non-RA parameters
                 continue
-            if p not in self.params():
+            if p not in params:
                 common_err("%s: parameter %s does not exist" % (id, p))
                 rc |= utils.get_check_rc()
         return rc
@@ -661,19 +973,22 @@ class RAInfo(object):
 
     def meta(self):
         '''
-        RA meta-data as raw xml.
+        RA meta-data as raw xml (list of lines). Only the parsed
+        meta-data is kept in memory (see mk_ra_node), the text
+        is read from the on-disk store or from the agent on each
+        call.
         '''
-        sid = "ra_meta-%s" % self.ra_string()
-        if cache.is_cached(sid):
-            return cache.retrieve(sid)
+        l = self.meta_store().get("meta")
+        if l:
+            return l
         if self.ra_class in constants.meta_progs:
             l = prog_meta(self.ra_class)
         else:
             l = ra_if().meta(self.ra_class, self.ra_type, self.ra_provider)
         if not l:
             return None
-        self.debug("read and cached meta-data")
-        return cache.store(sid, l)
+        self.debug("read meta-data")
+        return l
 
     def meta_pretty(self):
         '''
@@ -684,7 +999,7 @@ class RAInfo(object):
         l = []
         title = self.meta_title()
         l.append(title)
-        longdesc = get_nodes_text(self.ra_elem, "longdesc")
+        longdesc = self.schema.longdesc
         if longdesc:
             l.append(longdesc)
         if self.ra_class != "heartbeat":
@@ -697,28 +1012,25 @@ class RAInfo(object):
         return '\n\n'.join(l)
 
     def get_shortdesc(self, n):
-        name = n.get("name")
-        shortdesc = get_nodes_text(n, "shortdesc")
-        longdesc = get_nodes_text(n, "longdesc")
+        name = n.name
+        shortdesc = n.shortdesc
+        longdesc = n.longdesc
         if shortdesc and shortdesc not in (name, longdesc, self.ra_type):
             return shortdesc
         return ''
 
     def meta_title(self):
         s = self.ra_string()
-        shortdesc = self.get_shortdesc(self.ra_elem)
+        shortdesc = self.get_shortdesc(self.schema)
         if shortdesc:
             s = "%s (%s)" % (shortdesc, s)
         return s
 
     def meta_param_head(self, n):
-        name = n.get("name")
-        if not name:
-            return None
-        s = name
-        if n.get("required") == "1":
+        s = n.name
+        if n.required == "1":
             s = s + "*"
-        typ, default = self.param_type_default(n)
+        typ, default = n.type, n.default
         if typ and default:
             s = "%s (%s, [%s])" % (s, typ, default)
         elif typ:
@@ -728,12 +1040,8 @@ class RAInfo(object):
         return s
 
     def format_parameter(self, n):
-        head = self.meta_param_head(n)
-        if not head:
-            self.error("no name attribute for parameter")
-            return ""
-        l = [head]
-        longdesc = get_nodes_text(n, "longdesc")
+        l = [self.meta_param_head(n)]
+        longdesc = n.longdesc
         if longdesc:
             l.append(self.ra_tab + longdesc.replace("\n", "\n" + self.ra_tab) + '\n')
         return '\n'.join(l)
@@ -741,39 +1049,31 @@ class RAInfo(object):
     def meta_parameter(self, param):
         if self.mk_ra_node() is None:
             return ''
-        for c in self.ra_elem.xpath("//parameters/parameter"):
-            if c.get("name") == param:
-                return self.format_parameter(c)
+        p = self.schema.param(param)
+        if p is not None:
+            return self.format_parameter(p)
 
     def meta_parameters(self):
         if self.mk_ra_node() is None:
             return ''
-        l = []
-        for c in self.ra_elem.xpath("//parameters/parameter"):
-            s = self.format_parameter(c)
-            if s:
-                l.append(s)
+        l = [self.format_parameter(p) for p in self.schema.params]
         if l:
             return "Parameters (*: required, []: default):\n\n" + '\n'.join(l)
 
     def meta_action_head(self, n):
-        name = n.get("name")
-        if not name or name in self.skip_ops:
+        if n.name in self.skip_ops:
             return ''
-        if name == "monitor":
-            name = monitor_name_node(n)
-        s = "%-13s" % name
-        for a in n.attrib.keys():
+        s = "%-13s" % n.key
+        for a, v in n.attrs:
             if a in self.skip_op_attr:
                 continue
-            v = n.get(a)
             if v:
                 s = "%s %s=%s" % (s, a, v)
         return s
 
     def meta_actions(self):
         l = []
-        for c in self.ra_elem.xpath("//actions/action"):
+        for c in self.schema.actions:
             s = self.meta_action_head(c)
             if s:
                 l.append(self.ra_tab + s)
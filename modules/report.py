@@ -21,6 +21,9 @@ import time
 import datetime
 import re
 import glob
+import json
+import bisect
+import heapq
 import ConfigParser
 
 from . import config
@@ -28,9 +31,9 @@ from . import constants
 from . import userdir
 from .msg import common_debug, common_warn, common_err, common_error, common_info, warn_once
 from .xmlutil import file2cib_elem, get_rsc_children_ids, get_prim_children_ids
-from .xmlutil import compressed_file_to_cib
+from .xmlutil import compressed_file_root_attrs
 from .utils import file2str, shortdate, acquire_lock, append_file, ext_cmd, shorttime
-from .utils import page_string, release_lock, rmdir_r, parse_time, get_cib_attributes
+from .utils import page_string, page_strings, release_lock, rmdir_r, parse_time
 from .utils import is_pcmk_118, pipe_cmd_nosudo, file_find_by_name
 
 _NO_PSSH = False
@@ -84,11 +87,101 @@ def make_time(t):
     return t
 
 
-def syslog_ts(s):
-    """
-    Finds the timestamp in the given line
-    Returns as floating point, seconds
-    """
+_MONTHS = dict((m, i+1) for i, m in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")))
+
+# "Mon dd HH:MM" or "YYYY-MM-DDTHH:MM" (and the year) -> seconds
+_ts_memo = {}
+_TS_MEMO_MAX = 4096
+
+
+def _minute_ts(key, year, mon, day, hour, minute, isdst):
+    ts = _ts_memo.get(key)
+    if ts is None:
+        try:
+            datetime.date(year, mon, day)
+        except ValueError:
+            return None
+        if hour > 23 or minute > 59:
+            return None
+        if len(_ts_memo) >= _TS_MEMO_MAX:
+            _ts_memo.clear()
+        ts = time.mktime((year, mon, day, hour, minute, 0, 0, 0, isdst))
+        _ts_memo[key] = ts
+    return ts
+
+
+def _trad_ts(l):
+    "Mon dd HH:MM:SS"
+    if not YEAR or len(l) < 3:
+        return None
+    mon, day, hms = _MONTHS.get(l[0]), l[1], l[2]
+    if not mon or not day.isdigit() or len(hms) != 8 or \
+            hms[2] != ':' or hms[5] != ':' or \
+            not (hms[:2] + hms[3:5] + hms[6:]).isdigit():
+        return None
+    ts = _minute_ts((YEAR, l[0], day, hms[:5]),
+                    int(YEAR), mon, int(day), int(hms[:2]), int(hms[3:5]), -1)
+    sec = int(hms[6:])
+    if ts is None or sec > 61:
+        return None
+    return ts + sec
+
+
+def _iso_ts(t):
+    "YYYY-MM-DDTHH:MM:SS[.ffffff][Z|+HH:MM|-HH:MM]"
+    if len(t) < 19 or t[4] != '-' or t[7] != '-' or t[10] != 'T' or \
+            t[13] != ':' or t[16] != ':' or \
+            not (t[:4] + t[5:7] + t[8:10] + t[11:13] + t[14:16] + t[17:19]).isdigit():
+        return None
+    frac, rest = 0, t[19:]
+    if rest.startswith('.'):
+        i = 1
+        while i < len(rest) and rest[i].isdigit():
+            i += 1
+        if i == 1:
+            return None
+        frac, rest = int(rest[1:i][:6].ljust(6, '0')) / 1000000.0, rest[i:]
+    if rest and rest != 'Z' and not \
+            (len(rest) == 6 and rest[0] in '+-' and rest[3] == ':' and
+             (rest[1:3] + rest[4:]).isdigit()):
+        return None
+    # like convert_dt(): the time of day is taken as local,
+    # with dst off if there is a time zone
+    isdst = 0 if rest else -1
+    ts = _minute_ts((t[:16], isdst),
+                    int(t[:4]), int(t[5:7]), int(t[8:10]),
+                    int(t[11:13]), int(t[14:16]), isdst)
+    sec = int(t[17:19])
+    if ts is None or sec > 59:
+        return None
+    return ts + sec + frac
+
+
+def _fast_ts(s):
+    '''
+    Timestamp and node of a line in the traditional syslog
+    or ISO (rfc5424) format, without strptime. The format is
+    told by the first character. None if neither parser
+    recognizes the line.
+    '''
+    if not s:
+        return None
+    if s[0].isdigit():
+        l = s.split(None, 2)
+        ts = _iso_ts(l[0])
+        node_i = 1
+    else:
+        l = s.split(None, 4)
+        ts = _trad_ts(l)
+        node_i = 3
+    if ts is None:
+        return None
+    return ts, (l[node_i] if len(l) > node_i else None)
+
+
+def _syslog_ts_slow(s):
     try:
         # strptime defaults year to 1900 (sigh)
         # strptime returns a time_struct
@@ -103,8 +196,7 @@ def syslog_ts(s):
             return None
 
 
-def syslog2node(s):
-    '''Get the node from a syslog line.'''
+def _syslog2node_slow(s):
     try:
         # strptime defaults year to 1900 (sigh)
         time.strptime(' '.join(s.split()[0:3]),
@@ -118,6 +210,25 @@ def syslog2node(s):
             return None
 
 
+def syslog_ts(s):
+    """
+    Finds the timestamp in the given line
+    Returns as floating point, seconds
+    """
+    r = _fast_ts(s)
+    if r is None:
+        return _syslog_ts_slow(s)
+    return r[0]
+
+
+def syslog2node(s):
+    '''Get the node from a syslog line.'''
+    r = _fast_ts(s)
+    if r is None or r[1] is None:
+        return _syslog2node_slow(s)
+    return r[1]
+
+
 def seek_to_edge(f, ts, to_end):
     '''
     f contains lines with exactly the timestamp ts.
@@ -229,11 +340,11 @@ def log2node(log):
 
 def filter_log(sl, log_l):
     '''
-    Filter list of messages to get only those from the given log
-    files list.
+    Filter messages to get only those from the given log files
+    list. Returns a generator.
     '''
     node_l = [log2node(x) for x in log_l if x]
-    return [x for x in sl if is_our_log(x, node_l)]
+    return (x for x in sl if is_our_log(x, node_l))
 
 
 def first_log_lines(log_l):
@@ -272,6 +383,152 @@ def convert_dt(dt):
         return None
 
 
+class LogIndex(object):
+    '''
+    Sparse index of a log file: offset and timestamp of the
+    first line in each block of step bytes. It is kept next to
+    the log in <log>.idx and extended as long as the log only
+    grows.
+    '''
+    step = 64*1024
+    suffix = ".idx"
+
+    def __init__(self, log):
+        self.log = log
+        self.stamp = None
+        self.blocks = 0
+        self.pos = []
+        self.ts = []
+
+    def path(self):
+        return self.log + self.suffix
+
+    def _stamp(self):
+        st = os.stat(self.log)
+        return [YEAR, st.st_size, st.st_mtime]
+
+    def load(self):
+        try:
+            f = open(self.path())
+            try:
+                d = json.load(f)
+            finally:
+                f.close()
+            self.stamp, self.blocks = d["stamp"], d["blocks"]
+            self.pos, self.ts = d["pos"], d["ts"]
+        except (IOError, OSError, ValueError, KeyError, TypeError), msg:
+            common_debug("%s: %s" % (self.path(), msg))
+            self.stamp, self.blocks, self.pos, self.ts = None, 0, [], []
+
+    def save(self):
+        try:
+            f = open(self.path(), "w")
+            try:
+                json.dump({"stamp": self.stamp, "blocks": self.blocks,
+                           "pos": self.pos, "ts": self.ts}, f)
+            finally:
+                f.close()
+        except (IOError, OSError), msg:
+            common_debug("cannot save log index %s: %s" % (self.path(), msg))
+
+    def _line_ts(self, f, pos):
+        f.seek(pos)
+        return syslog_ts(f.readline())
+
+    def _is_prefix(self, f, stamp):
+        '''
+        The log has only been appended to since the index was
+        built.
+        '''
+        if not self.stamp or self.stamp[0] != stamp[0] or self.stamp[1] > stamp[1]:
+            return False
+        return not self.pos or self._line_ts(f, self.pos[-1]) == self.ts[-1]
+
+    def _scan(self, f, size):
+        '''
+        Index blocks from self.blocks on. The last indexed
+        block may have been incomplete, so it is indexed again.
+        '''
+        blk = max(self.blocks - 1, 0)
+        while self.pos and self.pos[-1] >= blk*self.step:
+            self.pos.pop()
+            self.ts.pop()
+        nblocks = (size + self.step - 1) / self.step
+        for blk in range(blk, nblocks):
+            f.seek(blk*self.step)
+            if blk > 0:
+                f.readline()  # skip the partial line
+            while f.tell() < (blk+1)*self.step:
+                pos = f.tell()
+                s = f.readline()
+                if not s:
+                    break
+                ts = syslog_ts(s)
+                if ts is None:
+                    continue
+                # keep the index sorted, even if the log isn't
+                if not self.ts or ts >= self.ts[-1]:
+                    self.pos.append(pos)
+                    self.ts.append(ts)
+                break
+        self.blocks = nblocks
+
+    def update(self, f=None):
+        '''
+        Load the index and bring it up to date with the log,
+        rebuild it if the log was rewritten.
+        '''
+        own_f = f is None
+        try:
+            stamp = self._stamp()
+            if own_f:
+                f = open(self.log)
+        except (IOError, OSError), msg:
+            common_debug("%s: %s" % (self.log, msg))
+            return False
+        try:
+            if self.stamp is None:
+                self.load()
+            if self.stamp == stamp:
+                return True
+            if not self._is_prefix(f, stamp):
+                common_debug("indexing log %s" % self.log)
+                self.blocks, self.pos, self.ts = 0, [], []
+            self._scan(f, stamp[1])
+            self.stamp = stamp
+            self.save()
+        finally:
+            if own_f:
+                f.close()
+        return True
+
+    def seek(self, f, ts, to_end=False):
+        '''
+        Move f to the first line with timestamp ts or later
+        (later than ts if to_end) and return the position.
+        '''
+        if not ts:
+            f.seek(0, to_end and 2 or 0)
+            return f.tell()
+        if to_end:
+            i = bisect.bisect_right(self.ts, ts)
+        else:
+            i = bisect.bisect_left(self.ts, ts)
+        f.seek(self.pos[i-1] if i > 0 else 0)
+        while True:
+            pos = f.tell()
+            s = f.readline()
+            if not s:
+                break
+            line_ts = syslog_ts(s)
+            if line_ts is None:
+                continue
+            if line_ts > ts or (not to_end and line_ts == ts):
+                break
+        f.seek(pos)
+        return pos
+
+
 class LogSyslog(object):
     '''
     Slice log, search log.
@@ -284,6 +541,7 @@ class LogSyslog(object):
         self.startpos = {}
         self.endpos = {}
         self.cache = {}
+        self.index = {}
         self.open_logs()
         self.set_log_timeframe(from_dt, to_dt)
 
@@ -320,8 +578,13 @@ class LogSyslog(object):
         bad_logs = []
         for log in self.f:
             f = self.f[log]
-            start = log_seek(f, self.from_ts)
-            end = log_seek(f, self.to_ts, to_end=True)
+            idx = self.log_index(log)
+            if idx:
+                start = idx.seek(f, self.from_ts)
+                end = idx.seek(f, self.to_ts, to_end=True)
+            else:
+                start = log_seek(f, self.from_ts)
+                end = log_seek(f, self.to_ts, to_end=True)
             if start == -1 or end == -1:
                 bad_logs.append(log)
             else:
@@ -331,6 +594,20 @@ class LogSyslog(object):
             del self.f[log]
             self.log_l.remove(log)
 
+    def log_index(self, log):
+        '''
+        Index of an uncompressed log, None for compressed
+        ones which cannot be sought in cheaply.
+        '''
+        if log not in self.index:
+            idx = None
+            if isinstance(self.f[log], file):
+                idx = LogIndex(log)
+                if not idx.update(self.f[log]):
+                    idx = None
+            self.index[log] = idx
+        return self.index[log]
+
     def get_match_line(self, f, patt):
         '''
         Get first line from f that matches re_s, but is not
@@ -345,18 +622,50 @@ class LogSyslog(object):
                 return s, fpos
         return '', -1
 
-    def single_log_list(self, f, patt):
-        l = []
+    def log_lines(self, f, patt):
+        '''
+        Generate lines from f that match patt, up to endpos[f].
+        '''
         while True:
             s = self.get_match_line(f, patt)[0]
             if not s:
-                return l
-            l.append(s)
-        return l
+                return
+            yield s
+
+    def log_matches(self, f, patt):
+        '''
+        Like log_lines, with timestamps. Lines without a
+        timestamp get the one of the previous line.
+        '''
+        ts = None
+        for s in self.log_lines(f, patt):
+            ts = syslog_ts(s) or ts
+            yield ts, s
+
+    def merge_logs(self, fl, patt):
+        '''
+        Merge matching lines from all files, sorted by time.
+        '''
+        heads = []
+        for i, f in enumerate(fl):
+            it = self.log_matches(f, patt)
+            head = next(it, None)
+            if head:
+                heads.append((head[0], i, head[1], it))
+        heapq.heapify(heads)
+        while heads:
+            ts, i, s, it = heads[0]
+            yield s
+            head = next(it, None)
+            if head:
+                heapq.heapreplace(heads, (head[0], i, head[1], it))
+            else:
+                heapq.heappop(heads)
 
     def search_logs(self, log_l, re_s=''):
         '''
-        Search logs for re_s and sort by time.
+        Search logs for re_s. Returns a generator of matching
+        lines sorted by time.
         '''
         try:
             patt = None
@@ -373,57 +682,28 @@ class LogSyslog(object):
             fl = [self.f[f] for f in self.f if self.f[f].name in log_l]
         for f in fl:
             f.seek(self.startpos[f])
-        # get head lines of all nodes
-        top_line = [self.get_match_line(x, patt)[0] for x in fl]
-        top_line_ts = []
-        rm_idx_l = []
-        # calculate time stamps for head lines
-        for i in range(len(top_line)):
-            if not top_line[i]:
-                rm_idx_l.append(i)
-            else:
-                top_line_ts.append(syslog_ts(top_line[i]))
-        # remove files with no matches found
-        rm_idx_l.reverse()
-        for i in rm_idx_l:
-            del fl[i], top_line[i]
         common_debug("search <%s> in %s" % (re_s, [f.name for f in fl]))
-        if len(fl) == 0:  # nothing matched ?
-            return []
         if len(fl) == 1:
             # no need to merge if there's only one log
-            return [top_line[0]] + self.single_log_list(fl[0], patt)
-        # search through multiple logs, merge sorted by time
-        l = []
-        first = 0
-        while True:
-            for i in range(len(fl)):
-                try:
-                    if i == first:
-                        continue
-                    if top_line_ts[i] and top_line_ts[i] < top_line_ts[first]:
-                        first = i
-                except:
-                    pass
-            if not top_line[first]:
-                break
-            l.append(top_line[first])
-            top_line[first] = self.get_match_line(fl[first], patt)[0]
-            if not top_line[first]:
-                top_line_ts[first] = time.time()
-            else:
-                top_line_ts[first] = syslog_ts(top_line[first])
-        return l
+            return self.log_lines(fl[0], patt)
+        return self.merge_logs(fl, patt)
 
-    def get_matches(self, re_l, log_l=None):
+    def iter_matches(self, re_l, log_l=None):
         '''
-        Return a list of log messages which
-        match one of the regexes in re_l.
+        Generate log messages which match one of the regexes
+        in re_l.
         '''
         if not log_l:
             log_l = self.log_l
         re_s = '|'.join(re_l)
         return filter_log(self.search_logs(log_l, re_s), log_l)
+
+    def get_matches(self, re_l, log_l=None):
+        '''
+        Return a list of log messages which
+        match one of the regexes in re_l.
+        '''
+        return list(self.iter_matches(re_l, log_l))
         # caching is not ready!
         # gets complicated because of different time frames
         # (TODO)
@@ -508,19 +788,31 @@ def extract_pe_file(msg):
     return msg_a[-1]
 
 
-def get_matching_run_msg(te_invoke_msg, trans_msg_l):
-    run_msg = ""
+def run_msg_index(trans_msg_l):
+    '''
+    Map PE file numbers to the first run_graph message
+    about them.
+    '''
+    run_re = re.compile(constants.transition_patt[1].replace("%%", "[0-9]+"))
+    d = {}
+    for msg in trans_msg_l:
+        r = run_re.search(msg)
+        if r and r.group(3) not in d:
+            d[r.group(3)] = msg
+    return d
+
+
+def get_matching_run_msg(te_invoke_msg, run_msg_d):
+    '''
+    run_msg_d is the index of run_graph messages built by
+    run_msg_index().
+    '''
     pe_file = extract_pe_file(te_invoke_msg)
     pe_num = get_pe_num(pe_file)
     if pe_num == "-1":
         common_warn("%s: strange, transition number not found" % pe_file)
         return ""
-    run_patt = constants.transition_patt[1].replace("%%", pe_num)
-    for msg in trans_msg_l:
-        if re.search(run_patt, msg):
-            run_msg = msg
-            break
-    return run_msg
+    return run_msg_d.get(pe_num, "")
 
 
 def trans_str(node, pe_file):
@@ -582,14 +874,14 @@ class Transition(object):
 
 
 def mkarchive(dir):
-    "Create an archive from a directory"
+    "Create an archive from a directory, without our index files"
     home = userdir.gethomedir()
     if not home:
         common_err("no home directory, nowhere to pack report")
         return False
     archive = '%s.tar.bz2' % os.path.join(home, os.path.basename(dir))
-    cmd = "tar -C '%s/..' -cj -f '%s' %s" % \
-        (dir, archive, os.path.basename(dir))
+    cmd = "tar -C '%s/..' --exclude='*%s' --exclude='%s' -cj -f '%s' %s" % \
+        (dir, LogIndex.suffix, PeIndex.index_file, archive, os.path.basename(dir))
     if pipe_cmd_nosudo(cmd) != 0:
         common_err('could not pack report, command "%s" failed' % cmd)
         return False
@@ -597,6 +889,79 @@ def mkarchive(dir):
         print "Report saved in '%s'" % archive
     return True
 
+
+class PeIndex(object):
+    '''
+    Attributes of the cib element of the PE inputs in a
+    report, read once per file and kept in the report directory
+    (pe-index.json). Entries are dropped when the file size or
+    mtime change.
+    '''
+    attrs = ("epoch", "admin_epoch", "num_updates", "dc-uuid",
+             "update-client", "update-user", "update-origin")
+    index_file = "pe-index.json"
+
+    def __init__(self, loc):
+        self.loc = loc
+        self.d = None
+        self.dirty = False
+
+    def path(self):
+        return os.path.join(self.loc, self.index_file)
+
+    def load(self):
+        self.d = {}
+        if not os.path.isfile(self.path()):
+            return
+        try:
+            f = open(self.path())
+            try:
+                self.d = json.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError), msg:
+            common_debug("%s: %s" % (self.path(), msg))
+        if not isinstance(self.d, dict):
+            self.d = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            f = open(self.path(), "w")
+            try:
+                json.dump(self.d, f)
+            finally:
+                f.close()
+            self.dirty = False
+        except (IOError, OSError), msg:
+            common_debug("cannot save PE index %s: %s" % (self.path(), msg))
+
+    def get(self, pe_file):
+        '''
+        Dict of attrs for pe_file, None if it can't be read.
+        '''
+        if self.d is None:
+            self.load()
+        try:
+            st = os.stat(pe_file)
+        except OSError, msg:
+            common_debug("%s: %s" % (pe_file, msg))
+            return None
+        key = os.path.relpath(pe_file, self.loc)
+        stamp = [st.st_size, st.st_mtime]
+        e = self.d.get(key)
+        if e and e[0] == stamp:
+            return e[1]
+        attrs = compressed_file_root_attrs(pe_file)
+        if attrs is None:
+            return None
+        attrs = dict((a, attrs[a]) for a in self.attrs if a in attrs)
+        self.d[key] = [stamp, attrs]
+        self.dirty = True
+        return attrs
+
+
 CH_SRC, CH_TIME, CH_UPD = 1, 2, 3
 
 
@@ -634,6 +999,7 @@ class Report(object):
         self.ready = False
         self.nodecolor = {}
         self.logobj = None
+        self.pe_index = None
         self.desc = None
         self.peinputs_l = []
         self.cibgrp_d = {}
@@ -833,6 +1199,7 @@ class Report(object):
                 continue
             append_file(rptlog, fl[0])
             update_loginfo(rptlog, logfile, nextpos, fl[0])
+            LogIndex(rptlog).update()
 
     def unpack_new_peinputs(self, node, pe_l):
         '''
@@ -1069,34 +1436,43 @@ class Report(object):
             i = (i+1) % len(self.nodecolors)
 
     def get_invoke_trans_msgs(self, msg_l):
-        te_invoke_patt = constants.transition_patt[0].replace("%%", "[0-9]+")
-        return [x for x in msg_l if re.search(te_invoke_patt, x)]
+        te_invoke_re = re.compile(constants.transition_patt[0].replace("%%", "[0-9]+"))
+        return [x for x in msg_l if te_invoke_re.search(x)]
 
     def get_all_trans_msgs(self, msg_l=None):
         trans_re_l = [x.replace("%%", "[0-9]+") for x in constants.transition_patt]
         if not msg_l:
             return self.logobj.get_matches(trans_re_l)
         else:
-            re_s = '|'.join(trans_re_l)
-            return [x for x in msg_l if re.search(re_s, x)]
+            trans_re = re.compile('|'.join(trans_re_l))
+            return [x for x in msg_l if trans_re.search(x)]
+
+    def pe_attrs(self, pe_file):
+        '''
+        Attributes of the cib element in the PE input (see
+        PeIndex).
+        '''
+        if self.pe_index is None or self.pe_index.loc != self.loc:
+            self.pe_index = PeIndex(self.loc)
+        return self.pe_index.get(pe_file)
 
     def is_empty_transition(self, t0, t1):
         num_actions = t1.actions_count()
-        if not (t0 and t1):
+        if not (t0 and t1) or num_actions != 0:
             return num_actions == 0
         old_pe_l_file = self.pe_report_path(t0)
         new_pe_l_file = self.pe_report_path(t1)
         if not os.path.isfile(old_pe_l_file) or not os.path.isfile(new_pe_l_file):
-            return num_actions == 0
-        old_cib = compressed_file_to_cib(old_pe_l_file)
-        new_cib = compressed_file_to_cib(new_pe_l_file)
-        if old_cib is None or new_cib is None:
-            return num_actions == 0
-        prev_epoch = old_cib.attrib.get("epoch", "0")
-        epoch = new_cib.attrib.get("epoch", "0")
-        prev_admin_epoch = old_cib.attrib.get("admin_epoch", "0")
-        admin_epoch = new_cib.attrib.get("admin_epoch", "0")
-        return num_actions == 0 and epoch == prev_epoch and admin_epoch == prev_admin_epoch
+            return True
+        old_attrs = self.pe_attrs(old_pe_l_file)
+        new_attrs = self.pe_attrs(new_pe_l_file)
+        if old_attrs is None or new_attrs is None:
+            return True
+        prev_epoch = old_attrs.get("epoch", "0")
+        epoch = new_attrs.get("epoch", "0")
+        prev_admin_epoch = old_attrs.get("admin_epoch", "0")
+        admin_epoch = new_attrs.get("admin_epoch", "0")
+        return epoch == prev_epoch and admin_epoch == prev_admin_epoch
 
     def list_transitions(self, msg_l=None, future_pe=False):
         '''
@@ -1124,8 +1500,9 @@ class Report(object):
                         (len(trans_msg_l)))
             progress = True
         prev_transition = None
+        run_msg_d = run_msg_index(trans_msg_l)
         for msg in trans_start_msg_l:
-            run_msg = get_matching_run_msg(msg, trans_msg_l)
+            run_msg = get_matching_run_msg(msg, run_msg_d)
             t_obj = Transition(msg, run_msg)
             if self.is_empty_transition(prev_transition, t_obj):
                 common_debug("skipping empty transition (%s)" % t_obj)
@@ -1188,6 +1565,8 @@ class Report(object):
             self.peinputs_l = []
             for new_t_obj in self.list_transitions():
                 self.new_peinput(new_t_obj)
+        if self.pe_index:
+            self.pe_index.save()
         self.ready = self.check_report()
         self.set_change_origin(0)
 
@@ -1283,8 +1662,8 @@ class Report(object):
 
     def display_logs(self, l):
         if self.log_filter_out_re:
-            l = [x for x in l if not self.match_filter_out(x)]
-        page_string('\n'.join([self.disp(x) for x in l]))
+            l = (x for x in l if not self.match_filter_out(x))
+        page_strings(self.disp(x) for x in l)
 
     def show_logs(self, log_l=None, re_l=[]):
         '''
@@ -1295,7 +1674,7 @@ class Report(object):
         if not self.central_log and not log_l:
             self.error("no logs found")
             return
-        self.display_logs(self.logobj.get_matches(re_l, log_l))
+        self.display_logs(self.logobj.iter_matches(re_l, log_l))
 
     def get_source(self):
         return self.source
@@ -1481,9 +1860,11 @@ class Report(object):
             # the format string occurs also below
             self._str_nodecolor(t_obj.dc, '%-13s' % t_obj.shortname())
         ]
-        l += get_cib_attributes(self.pe_report_path(t_obj), "cib",
-                                ("update-client", "update-user", "update-origin"),
-                                ("no-client", "no-user", "no-origin"))
+        attrs = self.pe_attrs(self.pe_report_path(t_obj)) or {}
+        l += [attrs.get(a) or dflt
+              for a, dflt in (("update-client", "no-client"),
+                              ("update-user", "no-user"),
+                              ("update-origin", "no-origin"))]
         return '%s %s %s  %-13s %-10s %-10s %s' % tuple(l)
 
     def pelist(self, a=None, long=False):
@@ -1498,6 +1879,8 @@ class Report(object):
              for x in self.peinputs_l if pe_file_in_range(x.pe_file, a)]
         if long:
             l = [self.pe_details_header, self.pe_details_separator] + l
+            if self.pe_index:
+                self.pe_index.save()
         return l
 
     def dotlist(self, a=None):
@@ -15,13 +15,14 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
-import shlex
 import sys
 from . import config
 from . import utils
 from . import options
 from .msg import common_err, common_info, common_warn
 from . import ui_utils
+from . import calltrace
+from . import profiler
 from . import userdir
 
 
@@ -71,7 +72,7 @@ class Context(object):
         rv = True
         cmd = False
         try:
-            tokens = shlex.split(line)
+            tokens = utils.tokenize(line)
             while tokens:
                 token, tokens = tokens[0], tokens[1:]
                 self.command_name = token
@@ -122,7 +123,7 @@ class Context(object):
                 return self.current_level().get_completions()
 
             try:
-                tokens = shlex.split(line)
+                tokens = utils.tokenize(line)
                 if complete_next:
                     tokens += ['']
                 while tokens:
@@ -250,7 +251,11 @@ class Context(object):
         # nskip = 2 to skip self and context when reporting errors
         ui_utils.validate_arguments(self.command_info.function, arglist, nskip=2)
         self.check_skill_level(self.command_info.skill_level)
-        rv = self.command_info.function(*arglist)
+        calltrace.set_command(self.get_qualified_name())
+        if profiler.enabled():
+            rv = profiler.run(self.get_qualified_name(), self.command_info.function, *arglist)
+        else:
+            rv = self.command_info.function(*arglist)
 
         # should we wait till the command takes effect?
         if rv and self.should_wait():
@@ -36,6 +36,8 @@ _legacy_map = {
     'manage_children': ('core', 'manage_children'),
     'force': ('core', 'force'),
     'debug': ('core', 'debug'),
+    'profile': ('core', 'profile'),
+    'cib_diff': ('core', 'cib_diff'),
     'ptest': ('core', 'ptest'),
     'dotty': ('core', 'dotty'),
     'dot': ('core', 'dot'),
@@ -152,6 +154,18 @@ class CliOptions(command.UI):
         "usage: add-quotes {yes|no}"
         return _legacy_set_pref("add-quotes", opt)
 
+    @command.completers(_yesno)
+    def do_profile(self, context, opt):
+        "usage: profile {yes|no}"
+        return _legacy_set_pref("profile", opt)
+
+    @command.name('cib-diff')
+    @command.alias('cib_diff')
+    @command.completers(_getprefs('cib_diff'))
+    def do_cib_diff(self, context, opt):
+        "usage: cib-diff {native|crm_diff|verify}"
+        return _legacy_set_pref("cib-diff", opt)
+
     @command.name('manage-children')
     @command.alias('manage_children')
     @command.completers(_getprefs('manage_children'))
@@ -180,6 +194,23 @@ class CliOptions(command.UI):
         else:
             show_options(lambda o: o.startswith(option) or o.endswith(option))
 
+    @command.completers(completers.choice(['clear']))
+    def do_cache(self, context, cmd=None):
+        "usage: cache [clear]"
+        from . import cache
+        from . import utils
+        from . import ra
+        if cmd == 'clear':
+            cache.invalidate()
+            return ra.clear_meta_store()
+        elif cmd is not None:
+            context.fatal_error("Expected 'clear', got '%s'" % (cmd))
+        s = "%-20s %8s %8s %8s %10s %8s\n" % ("cache", "entries", "hits", "misses",
+                                              "evictions", "expired")
+        for st in cache.stats():
+            s += "%-20s %8d %8d %8d %10d %8d\n" % st
+        utils.page_string(s)
+
     def do_save(self, context):
         "usage: save"
         config.save()
@@ -18,7 +18,6 @@
 
 import os
 import re
-import shlex
 from . import command
 from . import completers as compl
 from . import utils
@@ -318,7 +317,7 @@ class Template(command.UI):
                 inp = inp.encode('ascii')
             inp = inp.strip()
             try:
-                s = shlex.split(inp)
+                s = utils.tokenize(inp)
             except ValueError, msg:
                 common_err(msg)
                 continue
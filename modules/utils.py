@@ -30,6 +30,7 @@ from . import userdir
 from . import constants
 from . import options
 from . import term
+from . import calltrace
 from .msg import common_warn, common_info, common_debug, common_err, err_buf
 
 
@@ -247,6 +248,7 @@ def pipe_string(cmd, s):
     common_debug("piping string to %s" % cmd)
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE)
     try:
         p.communicate(s)
@@ -255,9 +257,65 @@ def pipe_string(cmd, s):
     except IOError, msg:
         if "Broken pipe" not in msg:
             common_err(msg)
+    calltrace.record(cmd, started, rc, len(s))
     return rc
 
 
+def _drain(f, chunks):
+    "Read f to the end into chunks (run in a thread)."
+    chunks.append(f.read())
+
+
+def pipe_strings(cmd, strings, capture=False):
+    """
+    Like pipe_string, but write the strings to the command
+    one by one, as they are produced.
+
+    With capture, the command is run as is (no sudo), its
+    stdout and stderr are collected while the input is written,
+    and (rc, stdout, stderr) is returned as by get_stdout_stderr.
+    """
+    import threading
+    rc = -1  # command failed
+    if not capture:
+        cmd = add_sudo(cmd)
+    common_debug("piping strings to %s" % cmd)
+    if options.regression_tests:
+        print ".EXT", cmd
+    started = calltrace.start()
+    nbytes = 0
+    if capture:
+        p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        outp, errp = [], []
+        readers = [threading.Thread(target=_drain, args=(p.stdout, outp)),
+                   threading.Thread(target=_drain, args=(p.stderr, errp))]
+        for t in readers:
+            t.daemon = True
+            t.start()
+    else:
+        p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE)
+    try:
+        for s in strings:
+            p.stdin.write(s)
+            nbytes += len(s)
+        p.stdin.close()
+    except IOError, msg:
+        if msg.errno != os.errno.EPIPE:
+            common_err(msg)
+    if capture:
+        for t in readers:
+            t.join()
+    p.wait()
+    rc = p.returncode
+    if not capture:
+        calltrace.record(cmd, started, rc, nbytes)
+        return rc
+    outp, errp = ''.join(outp), ''.join(errp)
+    calltrace.record(cmd, started, rc, nbytes, len(outp))
+    return rc, outp.strip(), errp.strip()
+
+
 def filter_string(cmd, s, stderr_on=True):
     rc = -1  # command failed
     outp = ''
@@ -269,6 +327,7 @@ def filter_string(cmd, s, stderr_on=True):
     common_debug("pipe through %s" % cmd)
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     p = subprocess.Popen(cmd,
                          shell=True,
                          stdin=subprocess.PIPE,
@@ -285,6 +344,7 @@ def filter_string(cmd, s, stderr_on=True):
     except Exception, msg:
         common_err(msg)
         common_info("from: %s" % cmd)
+    calltrace.record(cmd, started, rc, len(s), len(outp or ''))
     return rc, outp
 
 
@@ -410,13 +470,19 @@ def ext_cmd(cmd, shell=True):
     if options.regression_tests:
         print ".EXT", cmd
     common_debug("invoke: %s" % cmd)
-    return subprocess.call(cmd, shell=shell)
+    started = calltrace.start()
+    rc = subprocess.call(cmd, shell=shell)
+    calltrace.record(cmd, started, rc)
+    return rc
 
 
 def ext_cmd_nosudo(cmd, shell=True):
     if options.regression_tests:
         print ".EXT", cmd
-    return subprocess.call(cmd, shell=shell)
+    started = calltrace.start()
+    rc = subprocess.call(cmd, shell=shell)
+    calltrace.record(cmd, started, rc)
+    return rc
 
 
 def rmdir_r(d):
@@ -502,6 +568,7 @@ def release_lock(dir):
 def pipe_cmd_nosudo(cmd):
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     proc = subprocess.Popen(cmd,
                             shell=True,
                             stdout=subprocess.PIPE,
@@ -509,6 +576,7 @@ def pipe_cmd_nosudo(cmd):
     (outp, err_outp) = proc.communicate()
     proc.wait()
     rc = proc.returncode
+    calltrace.record(cmd, started, rc, 0, len(outp))
     if rc != 0:
         print outp
         print err_outp
@@ -527,12 +595,15 @@ def get_stdout(cmd, input_s=None, stderr_on=True, shell=True):
         stderr = subprocess.PIPE
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     proc = subprocess.Popen(cmd,
                             shell=shell,
                             stdin=subprocess.PIPE,
                             stdout=subprocess.PIPE,
                             stderr=stderr)
     stdout_data, stderr_data = proc.communicate(input_s)
+    calltrace.record(cmd, started, proc.returncode,
+                     len(input_s or ''), len(stdout_data))
     return proc.returncode, stdout_data.strip()
 
 
@@ -542,12 +613,15 @@ def get_stdout_stderr(cmd, input_s=None, shell=True):
     '''
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     proc = subprocess.Popen(cmd,
                             shell=shell,
                             stdin=input_s and subprocess.PIPE or None,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE)
     stdout_data, stderr_data = proc.communicate(input_s)
+    calltrace.record(cmd, started, proc.returncode,
+                     len(input_s or ''), len(stdout_data))
     return proc.returncode, stdout_data.strip(), stderr_data.strip()
 
 
@@ -652,7 +726,9 @@ def wait4dc(what="", show_progress=True):
 
 def run_ptest(graph_s, nograph, scores, utilization, actions, verbosity):
     '''
-    Pipe graph_s thru ptest(8). Show graph using dotty if requested.
+    Pipe graph_s (a string or an iterable of strings, written
+    as produced) thru ptest(8). Show graph using dotty if
+    requested.
     '''
     actions_filter = "grep LogActions: | grep -vw Leave"
     ptest = "2>&1 %s -x -" % config.core.ptest
@@ -678,7 +754,11 @@ def run_ptest(graph_s, nograph, scores, utilization, actions, verbosity):
     if options.regression_tests:
         ptest = ">/dev/null %s" % ptest
     common_debug("invoke: %s" % ptest)
-    rc, s = get_stdout(ptest, input_s=graph_s)
+    if isinstance(graph_s, basestring):
+        graph_s = [graph_s]
+    rc, s, errs = pipe_strings(ptest, graph_s, capture=True)
+    if errs:
+        print >> sys.stderr, errs
     if rc != 0:
         common_debug("%s exited with %d" % (ptest, rc))
         if actions and rc == 1:
@@ -834,10 +914,12 @@ def is_process(s):
     cmd = "ps -e -o pid,command | grep -qs '%s'" % s
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     proc = subprocess.Popen(cmd,
                             shell=True,
                             stdout=subprocess.PIPE)
     proc.wait()
+    calltrace.record(cmd, started, proc.returncode)
     return proc.returncode == 0
 
 
@@ -899,15 +981,20 @@ def edit_file_ext(fname, template=''):
 
 
 def need_pager(s, w, h):
+    return term_rows(s, w, h) >= h
+
+
+def term_rows(s, w, h=None):
+    'Number of terminal rows s takes (counts at most to h).'
     from math import ceil
     cnt = 0
     for l in s.split('\n'):
         # need to remove color codes
         l = re.sub(r'\${\w+}', '', l)
         cnt += int(ceil((len(l) + 0.5)/w))
-        if cnt >= h:
-            return True
-    return False
+        if h is not None and cnt >= h:
+            break
+    return cnt
 
 
 def term_render(s):
@@ -940,6 +1027,37 @@ def page_string(s):
         pipe_string(get_pager_cmd(), term_render(s))
 
 
+def page_strings(strings):
+    """
+    Page strings (lines or blocks of lines) rendered for TERM as
+    they are produced. Only a screenful is kept to decide whether
+    the pager is needed at all.
+    """
+    use_pager = config.core.pager and can_ask() and not options.batch
+    w, h = get_winsize()
+    it = iter(strings)
+    l = []
+    rows = 0
+    for s in it:
+        if not use_pager:
+            print term_render(s)
+            continue
+        l.append(s)
+        rows += term_rows(s, w, h)
+        if rows >= h:
+            break
+    else:
+        if l:
+            print term_render('\n'.join(l))
+        return
+
+    def rendered():
+        yield term_render('\n'.join(l))
+        for s in it:
+            yield '\n' + term_render(s)
+    pipe_strings(get_pager_cmd(), rendered())
+
+
 def page_file(filename):
     'Open file in pager'
     if not os.path.isfile(filename):
@@ -1227,6 +1345,16 @@ def cibadmin_can_patch():
     return is_min_pcmk_ver("1.1.11")
 
 
+def cibadmin_can_patch_v2():
+    # the v2 patch format was introduced in 1.1.12
+    return is_min_pcmk_ver("1.1.12")
+
+
+def cibadmin_can_skip_children():
+    # cibadmin --no-children is not there before 1.1.13
+    return is_min_pcmk_ver("1.1.13")
+
+
 # quote function from python module shlex.py in python 3.3
 
 _find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
@@ -1244,6 +1372,55 @@ def quote(s):
     return "'" + s.replace("'", "'\"'\"'") + "'"
 
 
+_lex_special = re.compile(r'[\'"\\\f\v]').search
+_lex_token = re.compile(r"""
+    ([^ \t\r\n'"\\]+)     # plain characters
+    |\\(.)                # escaped character
+    |'([^']*)'             # single quoted
+    |"((?:[^"\\]|\\.)*)"   # double quoted
+    |([ \t\r\n]+)         # separator
+    """, re.S | re.X)
+_lex_dq_escape = re.compile(r'\\(["\\])')
+# unclosed double quote ending in a backslash
+_lex_dq_dangling = re.compile(r'"(?:[^"\\]|\\.)*\\\Z', re.S).match
+
+
+def tokenize(s):
+    """
+    Split a line into a list of tokens, the same way as
+    shlex.split() does, but a lot faster. Raises ValueError
+    on unbalanced quotes or a trailing backslash.
+    """
+    if not _lex_special(s):
+        return s.split()
+    tokens = []
+    token = None
+    pos, end = 0, len(s)
+    match = _lex_token.match
+    while pos < end:
+        m = match(s, pos)
+        if m is None:
+            if s[pos] == '\\' or _lex_dq_dangling(s, pos):
+                raise ValueError("No escaped character")
+            raise ValueError("No closing quotation")
+        pos = m.end()
+        idx = m.lastindex
+        if idx == 5:
+            if token is not None:
+                tokens.append(token)
+                token = None
+            continue
+        if token is None:
+            token = ''
+        if idx == 4:
+            token += _lex_dq_escape.sub(r'\1', m.group(4))
+        else:
+            token += m.group(idx)
+    if token is not None:
+        tokens.append(token)
+    return tokens
+
+
 def fetch_opts(args, opt_l):
     '''
     Get and remove option keywords from args.
@@ -26,6 +26,7 @@ from . import config
 from . import options
 from . import schema
 from . import constants
+from . import calltrace
 from .msg import common_err, common_error, common_debug, cib_parse_err, err_buf
 from . import userdir
 from . import utils
@@ -78,6 +79,33 @@ def compressed_file_to_cib(s):
     return cib_elem
 
 
+def compressed_file_root_attrs(s):
+    '''
+    Attributes of the top element of the XML in file s,
+    without reading or decompressing the rest of the file.
+    '''
+    try:
+        if s.endswith('.bz2'):
+            f = bz2.BZ2File(s)
+        elif s.endswith('.gz'):
+            import gzip
+            f = gzip.open(s)
+        else:
+            f = open(s)
+    except IOError, msg:
+        common_err(msg)
+        return None
+    try:
+        for event, elem in etree.iterparse(f, events=("start",)):
+            return dict(elem.attrib)
+    except Exception, msg:
+        common_err("cannot parse xml in %s: %s" % (s, msg))
+        return None
+    finally:
+        f.close()
+    return None
+
+
 cib_dump = "cibadmin -Ql"
 
 
@@ -85,10 +113,12 @@ def sudocall(cmd):
     cmd = add_sudo(cmd)
     if options.regression_tests:
         print ".EXT", cmd
+    started = calltrace.start()
     p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     try:
         outp, errp = p.communicate()
         p.wait()
+        calltrace.record(cmd, started, p.returncode, 0, len(outp))
         return p.returncode, outp, errp
     except IOError, msg:
         common_err("running %s: %s" % (cmd, msg))
@@ -137,6 +167,79 @@ def cibdump2elem(section=None):
     return None
 
 
+cib_version_dump = "%s --xpath /cib --no-children" % cib_dump
+_cibdump_cache = {}
+_version_probe = None  # can cib_version_dump be used? (None: not known yet)
+
+
+def _elem_version(e, with_updates):
+    attrs = ["admin_epoch", "epoch"]
+    if with_updates:
+        attrs.append("num_updates")
+    return tuple(e.get(a) for a in attrs)
+
+
+def _can_probe_version():
+    global _version_probe
+    if _version_probe is None:
+        _version_probe = utils.cibadmin_can_skip_children()
+    return _version_probe
+
+
+def _cib_version(with_updates):
+    """
+    Get the CIB version without dumping the CIB. If that fails,
+    it is not tried again.
+    """
+    global _version_probe
+    rc, outp, _ = sudocall(cib_version_dump)
+    try:
+        if rc == 0 and outp:
+            return _elem_version(etree.fromstring(outp), with_updates)
+    except etree.XMLSyntaxError:
+        pass
+    common_debug("%s failed, CIB dumps are not cached" % cib_version_dump)
+    _version_probe = False
+    return None
+
+
+def cached_cibdump2elem(section=None):
+    """
+    Like cibdump2elem, but keep the result and reuse it as long
+    as the CIB version stays the same (num_updates counts only
+    if the status is included). The returned element is shared:
+    it must not be modified.
+    The first dump of the whole CIB carries its version; for a
+    section, the version is asked for before dumping it. If
+    cibadmin cannot tell the version, nothing is cached.
+    """
+    if not _can_probe_version():
+        return cibdump2elem(section)
+    with_updates = section in (None, "status")
+    key = (os.getenv("CIB_shadow"), os.getenv("CIB_file"), section)
+    version = None
+    entry = _cibdump_cache.get(key)
+    if entry is not None or section is not None:
+        version = _cib_version(with_updates)
+        if version is None:
+            _cibdump_cache.clear()
+            return cibdump2elem(section)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    cib_elem = cibdump2elem(section)
+    if cib_elem is None:
+        return None
+    if version is None:
+        version = _elem_version(cib_elem, with_updates)
+    _cibdump_cache[key] = (version, cib_elem)
+    return cib_elem
+
+
+def clear_cibdump_cache():
+    "The CIB changed (we just committed)."
+    _cibdump_cache.clear()
+
+
 def read_cib(fun, params=None):
     cib_elem = fun(params)
     if cib_elem is None or cib_elem.tag != "cib":
@@ -193,23 +296,57 @@ class RscState(object):
     Get the resource status and some other relevant bits.
     In particular, this class should allow for a bit of caching
     of cibadmin -Q -o resources output in case we need to check
-    more than one resource in a row.
+    more than one resource in a row. The same goes for the
+    resource status, which is read from one crm_mon run.
     '''
 
     rsc_status = "crm_resource -W -r '%s'"
+    mon_status = "crm_mon --as-xml"
 
     def __init__(self):
         self.current_cib = None
         self.rsc_elem = None
         self.prop_elem = None
         self.rsc_dflt_elem = None
+        self.rsc_ids = {}       # id -> element within resources
+        self.status_read = False
+        self.running = None     # ids of running resources
 
     def _init_cib(self):
-        cib = cibdump2elem("configuration")
+        cib = cached_cibdump2elem("configuration")
         self.current_cib = cib
         self.rsc_elem = get_first_conf_elem(cib, "resources")
         self.prop_elem = get_first_conf_elem(cib, "crm_config/cluster_property_set")
         self.rsc_dflt_elem = get_first_conf_elem(cib, "rsc_defaults/meta_attributes")
+        self.rsc_ids = {}
+        if self.rsc_elem is not None:
+            for e in self.rsc_elem.iter(tag=etree.Element):
+                e_id = e.get("id")
+                if e_id is not None and e_id not in self.rsc_ids:
+                    self.rsc_ids[e_id] = e
+
+    def _init_status(self):
+        '''
+        Collect the ids of all running resources and of their
+        containers. Leaves running at None if crm_mon didn't
+        work out.
+        '''
+        self.status_read = True
+        rc, outp = get_stdout(self.mon_status, stderr_on=False)
+        if rc != 0:
+            return
+        try:
+            mon = etree.fromstring(outp)
+        except Exception:
+            return
+        self.running = set()
+        for e in mon.iter("resource"):
+            if e.get("active") != "true":
+                continue
+            while e is not None and e.tag != "resources":
+                # instances of anonymous clones are id:N
+                self.running.add(e.get("id", "").split(":")[0])
+                e = e.getparent()
 
     def rsc2node(self, id):
         '''
@@ -220,14 +357,7 @@ class RscState(object):
         '''
         if self.rsc_elem is None:
             self._init_cib()
-        if self.rsc_elem is None:
-            return None
-        # does this need to be optimized?
-        expr = './/*[@id="%s"]' % id
-        try:
-            return self.rsc_elem.xpath(expr)[0]
-        except (IndexError, AttributeError):
-            return None
+        return self.rsc_ids.get(id)
 
     def is_ms(self, id):
         '''
@@ -288,6 +418,10 @@ class RscState(object):
         if not is_live_cib():
             return False
         test_id = self.rsc_clone(id) or id
+        if not self.status_read:
+            self._init_status()
+        if self.running is not None:
+            return test_id in self.running
         rc, outp = get_stdout(self.rsc_status % test_id, stderr_on=False)
         return outp.find("running") > 0 and outp.find("NOT") == -1
 
@@ -309,7 +443,7 @@ class RscState(object):
 
 
 def resources_xml():
-    return cibdump2elem("resources")
+    return cached_cibdump2elem("resources")
 
 
 def is_normal_node(n):
@@ -350,7 +484,7 @@ def mk_rsc_type(n):
 
 
 def listnodes():
-    cib = cibdump2elem()
+    cib = cached_cibdump2elem()
     if cib is None:
         return []
     local_nodes = cib.xpath('/cib/configuration/nodes/node/@uname')
@@ -617,6 +751,28 @@ def is_related(rsc_id, node):
     return False
 
 
+def related_ids(node):
+    """
+    Ids of all elements to which the given node has a direct
+    relation (see is_related), and the template of a
+    primitive.
+    """
+    if is_constraint(node):
+        ids = [node.get(attr) for attr in node.keys()
+               if attr in constants.constraint_rsc_refs]
+        ids += node.xpath("resource_set/resource_ref/@id")
+    elif node.tag == 'tag':
+        ids = node.xpath('.//obj_ref/@id')
+    elif is_container(node):
+        ids = node.xpath('.//*[self::primitive or self::group or '
+                         'self::clone or self::master]/@id')
+    elif is_primitive(node):
+        ids = [node.get("template")]
+    else:
+        return set()
+    return set(str(x) for x in ids if x)
+
+
 def sort_container_children(e_list):
     '''
     Make sure that attributes's nodes are first, followed by the
@@ -1212,6 +1368,169 @@ def get_set_nodes(e, setname, create=False):
     return l
 
 
+_cib_version_attrs = ("admin_epoch", "epoch", "num_updates")
+
+
+def _patch_key(e):
+    if is_comment(e):
+        return (None, e.text)
+    return (e.tag, e.get("id"))
+
+
+def _patch_path(path, key):
+    tag, node_id = key
+    if node_id is None:
+        return "%s/%s" % (path, tag)
+    return "%s/%s[@id='%s']" % (path, tag, node_id)
+
+
+def _norm_text(t):
+    "Whitespace only text is as good as none."
+    return t if t is not None and t.strip() else None
+
+
+def _xml_same(a, b):
+    """
+    Compare two elements, children in order. The whitespace
+    between elements (tails and whitespace only text) is not
+    compared.
+    """
+    if is_comment(a) or is_comment(b):
+        return a.tag == b.tag and a.text == b.text
+    if a.tag != b.tag or len(a) != len(b) or dict(a.attrib) != dict(b.attrib):
+        return False
+    if _norm_text(a.text) != _norm_text(b.text):
+        return False
+    for x, y in zip(a, b):
+        if not _xml_same(x, y):
+            return False
+    return True
+
+
+def _top_elem(conf, e):
+    """
+    The element which contains e and is either in a section of
+    conf or right in conf (such as fencing-topology). None if e
+    is not in conf.
+    """
+    chain = [e]
+    while chain[-1].getparent() is not conf:
+        if chain[-1].getparent() is None:
+            return None
+        chain.append(chain[-1].getparent())
+    return chain[-2] if len(chain) > 1 else e
+
+
+def _diff_children(old, new, path, dirty, changes):
+    """
+    Compare the children of two elements by tag and id. Elements
+    which exist only in old are deleted, those which exist only
+    in new are created, and those in dirty (by key) which differ
+    are replaced. The others are not looked into. Returns False
+    if the difference cannot be expressed this way.
+    """
+    old_keys = [_patch_key(e) for e in old]
+    new_keys = [_patch_key(e) for e in new]
+    old_d = dict(zip(old_keys, old))
+    new_d = dict(zip(new_keys, new))
+    if len(old_d) != len(old_keys) or len(new_d) != len(new_keys):
+        return False  # duplicate keys
+    deletes = [key for key in old_keys if key not in new_d]
+    creates = []
+    for pos, key in enumerate(new_keys):
+        if key not in old_d:
+            creates.append((pos, key))
+        elif key in dirty and not _xml_same(old_d[key], new_d[key]):
+            deletes.append(key)
+            creates.append((pos, key))
+    touched = set(deletes) | set(key for pos, key in creates)
+    if any(key[0] is None for key in touched):
+        return False  # comments cannot be addressed
+    # whatever is not touched must keep its relative order
+    if [key for key in old_keys if key not in touched] != \
+            [key for key in new_keys if key not in touched]:
+        return False
+    for key in deletes:
+        changes.append(("delete", _patch_path(path, key), None, None))
+    for pos, key in creates:
+        changes.append(("create", path, pos, new_d[key]))
+    return True
+
+
+def cib_patch(old_cib, new_cib, changed, removed):
+    """
+    Build a v2 patch (as produced by crm_diff --no-version) which
+    transforms old_cib into new_cib. Only the elements in changed
+    (modified elements, as found in new_cib) and in removed
+    (elements taken out of the configuration) are looked at:
+    the children of the sections they belong to are compared by
+    tag and id, and those of them which differ are replaced as a
+    whole. Returns None if the difference cannot be expressed
+    this way.
+    """
+    old_conf = old_cib.find("configuration")
+    new_conf = new_cib.find("configuration")
+    if old_conf is None or new_conf is None:
+        return None
+    # parent tag (None for configuration) -> keys to compare
+    dirty = {}
+
+    def mark(conf, e):
+        top = _top_elem(conf, e)
+        if top is None:
+            return False
+        parent = top.getparent()
+        if parent is not conf and \
+                (old_conf.find(parent.tag) is None or new_conf.find(parent.tag) is None):
+            # a new or a removed section
+            top, parent = parent, conf
+        tag = None if parent is conf else parent.tag
+        dirty.setdefault(tag, set()).add(_patch_key(top))
+        return True
+
+    for e in changed:
+        if not mark(new_conf, e):
+            return None
+    for e in removed:
+        if e.get("id") is None:
+            l = old_conf.findall(e.tag)
+        else:
+            l = old_conf.xpath(".//*[@id=$id]", id=e.get("id"))
+        if len(l) != 1 or not mark(old_conf, l[0]):
+            return None
+    changes = []
+    for tag, keys in dirty.iteritems():
+        if tag is None:
+            old, new, path = old_conf, new_conf, "/cib/configuration"
+        else:
+            old, new = old_conf.find(tag), new_conf.find(tag)
+            path = "/cib/configuration/%s" % tag
+        if not _diff_children(old, new, path, keys, changes):
+            return None
+    diff = etree.Element("diff", format="2")
+    attrs = [(a, v) for a, v in new_cib.items()
+             if a not in _cib_version_attrs and old_cib.get(a) != v]
+    unset = [a for a in old_cib.keys()
+             if a not in _cib_version_attrs and new_cib.get(a) is None]
+    if attrs or unset:
+        change = etree.SubElement(diff, "change", operation="modify", path="/cib")
+        change_list = etree.SubElement(change, "change-list")
+        for a, v in attrs:
+            etree.SubElement(change_list, "change-attr", name=a, operation="set", value=v)
+        for a in unset:
+            etree.SubElement(change_list, "change-attr", name=a, operation="unset")
+        result = etree.SubElement(change, "change-result")
+        etree.SubElement(result, "cib", dict((a, v) for a, v in new_cib.items()
+                                             if a not in _cib_version_attrs))
+    # deletes come first, creates then in ascending position
+    for op, path, pos, e in sorted(changes, key=lambda c: (c[0] == "create", c[1], c[2])):
+        change = etree.SubElement(diff, "change", operation=op, path=path)
+        if pos is not None:
+            change.set("position", str(pos))
+            change.append(copy.deepcopy(e))
+    return diff
+
+
 _checker = doctestcompare.LXMLOutputChecker()
 
 
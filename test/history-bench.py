@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark for the history log timestamp parser: reports
+# the time it takes to get the timestamp and the node of a log
+# line, over the logs in history-test.tar.bz2.
+#
+# Usage: history-bench.py [-n <rounds>] [--slow]
+#
+# --slow uses the strptime based parser.
+
+import os
+import sys
+import time
+import glob
+import shutil
+import tarfile
+import tempfile
+from optparse import OptionParser
+
+parent, bindir = os.path.split(os.path.dirname(os.path.abspath(sys.argv[0])))
+if os.path.exists(os.path.join(parent, 'modules')):
+    sys.path.insert(0, parent)
+
+import modules
+sys.modules['crmsh'] = modules
+from modules import msg
+from modules import report
+
+
+def read_logs():
+    tarball = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                           "history-test.tar.bz2")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tarfile.open(tarball).extractall(tmpdir)
+        desc = glob.glob(os.path.join(tmpdir, "*", "description.txt"))[0]
+        report.set_year(os.stat(desc).st_mtime)
+        lines = []
+        for log in glob.glob(os.path.join(tmpdir, "*", "*", "ha-log.txt")):
+            lines += open(log).readlines()
+        return lines
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    op = OptionParser(usage="%prog [-n <rounds>] [--slow]")
+    op.add_option("-n", dest="rounds", type="int", default=50)
+    op.add_option("--slow", dest="slow", action="store_true", default=False)
+    opts, args = op.parse_args()
+    msg.ERR_STREAM = None
+    lines = read_logs()
+    if opts.slow:
+        syslog_ts, syslog2node = report._syslog_ts_slow, report._syslog2node_slow
+    else:
+        syslog_ts, syslog2node = report.syslog_ts, report.syslog2node
+    start = time.time()
+    for _ in xrange(opts.rounds):
+        for line in lines:
+            syslog_ts(line)
+            syslog2node(line)
+    elapsed = time.time() - start
+    nlines = opts.rounds * len(lines)
+    print "%d lines, %.1f usec per line" % (nlines, elapsed * 1e6 / nlines)
+
+main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark for the CLI parser: reports the time it takes
+# to parse a configuration line.
+#
+# Usage: parse-bench.py [-n <rounds>] [--uncached]
+#
+# --uncached matches the score patterns of validate_score() with
+# re.match() and re.sub(), through the re module's cache, the way
+# the parser did before they were compiled class attributes.
+
+import os
+import re
+import sys
+import time
+from optparse import OptionParser
+
+parent, bindir = os.path.split(os.path.dirname(os.path.abspath(sys.argv[0])))
+if os.path.exists(os.path.join(parent, 'modules')):
+    sys.path.insert(0, parent)
+
+import modules
+sys.modules['crmsh'] = modules
+from modules import msg
+from modules import parse
+
+_LINES = """node node-1
+node $id=testid node-1:ping attributes mem=16G
+primitive www ocf:heartbeat:apache op monitor timeout=10s
+rsc_template public_vm ocf:heartbeat:Xen op start timeout=300s op stop timeout=300s op monitor interval=30s timeout=60s op migrate_from timeout=600s op migrate_to timeout=600s
+primitive st stonith:ssh params hostlist=node1 meta target-role=Started op start requires=nothing timeout=60s op monitor interval=60m timeout=60s
+ms m0 resource params a=b
+group group-1 a b c
+location loc-1 resource inf: foo
+location loc-1 thing rule role=slave -inf: #uname eq madrid
+colocation col-1 -20: foo:Master ( bar wiz ) ( zip zoo ) node-attribute="fiz"
+order o1 Mandatory: [ A B sequential=true ] C
+property stonith-enabled=true no-quorum-policy=ignore
+fencing_topology poison-pill power
+tag t1 a b c""".split('\n')
+
+
+class BenchValidation(parse.Validation):
+    def resource_roles(self):
+        return ['Master', 'Slave', 'Started']
+
+    def resource_actions(self):
+        return ['start', 'stop', 'promote', 'demote']
+
+    def date_ops(self):
+        return ['lt', 'gt', 'in_range', 'date_spec']
+
+    def expression_types(self):
+        return ['normal', 'string', 'number']
+
+    def rsc_order_kinds(self):
+        return ['Mandatory', 'Optional', 'Serialize']
+
+    def op_attributes(self):
+        return ['id', 'name', 'interval', 'timeout', 'description',
+                'start-delay', 'interval-origin', 'timeout', 'enabled',
+                'record-pending', 'role', 'requires', 'on-fail']
+
+    def acl_2_0(self):
+        return True
+
+
+class UncachedRe(object):
+    "Pattern string matched with the re module functions"
+    def __init__(self, rx, flags=0):
+        self.rx = rx
+        self.flags = flags
+
+    def match(self, s):
+        return re.match(self.rx, s, self.flags)
+
+    def sub(self, repl, s):
+        return re.sub(self.rx, repl, s)
+
+
+def main():
+    op = OptionParser(usage="%prog [-n <rounds>] [--uncached]")
+    op.add_option("-n", dest="rounds", type="int", default=200)
+    op.add_option("--uncached", dest="uncached", action="store_true", default=False)
+    opts, args = op.parse_args()
+    if opts.uncached:
+        parse.RuleParser._SCORE_VALUE_RE = UncachedRe(parse.RuleParser._SCORE_VALUE_RE.pattern)
+        parse.RuleParser._INFINITY_RE = UncachedRe(parse.RuleParser._INFINITY_RE.pattern)
+    msg.ERR_STREAM = None
+    parser = parse.CliParser()
+    validation = BenchValidation()
+    for p in parser.parsers.itervalues():
+        p.validation = validation
+    start = time.time()
+    for _ in xrange(opts.rounds):
+        for line in _LINES:
+            parser.parse(line)
+    elapsed = time.time() - start
+    nlines = opts.rounds * len(_LINES)
+    print "%d lines, %.1f usec per line" % (nlines, elapsed * 1e6 / nlines)
+
+main()
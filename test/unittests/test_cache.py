@@ -0,0 +1,59 @@
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+# unit tests for cache.py
+
+from crmsh import cache
+from nose.tools import eq_
+
+
+def _stats(name):
+    return [st for st in cache.stats() if st[0] == name][0]
+
+
+def test_lru():
+    cache.namespace("test_lru", max_entries=2)
+    cache.store("test_lru", "a", 1)
+    cache.store("test_lru", "b", 2)
+    eq_(cache.retrieve("test_lru", "a"), 1)
+    cache.store("test_lru", "c", 3)
+    # b was used least recently
+    eq_(cache.retrieve("test_lru", "b"), None)
+    eq_(cache.retrieve("test_lru", "a"), 1)
+    eq_(cache.retrieve("test_lru", "c"), 3)
+    eq_(_stats("test_lru"), ("test_lru", 2, 3, 1, 1, 0))
+
+
+def test_ttl():
+    cache.namespace("test_ttl", ttl=60)
+    cache.store("test_ttl", "a", [])
+    eq_(cache.retrieve("test_ttl", "a"), [])
+    ns = cache._get("test_ttl")
+    stamp, value = ns.entries["a"]
+    ns.entries["a"] = (stamp - 61, value)
+    eq_(cache.retrieve("test_ttl", "a"), None)
+    eq_(_stats("test_ttl"), ("test_ttl", 0, 1, 1, 0, 1))
+
+
+def test_invalidate():
+    cache.namespace("test_inv")
+    cache.store("test_inv", "a", 1)
+    cache.store("test_inv", "b", 2)
+    cache.invalidate("test_inv", "a")
+    eq_(cache.retrieve("test_inv", "a"), None)
+    eq_(cache.retrieve("test_inv", "b"), 2)
+    cache.invalidate()
+    eq_(cache.retrieve("test_inv", "b"), None)
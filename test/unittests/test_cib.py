@@ -15,6 +15,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 #
 from crmsh import cibconfig
+from crmsh import constants
 from lxml import etree
 from nose.tools import eq_
 import copy
@@ -39,3 +40,390 @@ def test_cib_schema_change():
     factory._copy_cib_attributes(copy_of_cib, factory.cib_orig)
     eq_(factory.cib_attrs["validate-with"], "pacemaker-1.1")
     eq_(factory.cib_elem.get("validate-with"), "pacemaker-1.1")
+
+
+def test_find_objects():
+    "Object lookup by id, uname and glob"
+    xml = '''<primitive class="ocf" id="%s" provider="pacemaker" type="Dummy"/>'''
+    obj1 = factory.create_from_node(etree.fromstring(xml % ('fo1')))
+    obj2 = factory.create_from_node(etree.fromstring(xml % ('fo2')))
+    assert factory.find_object('fo1') is obj1
+    eq_(set(factory.find_objects('fo*')), set([obj1, obj2]))
+    eq_(factory.find_object('ha-two').obj_id, '2')
+    factory.rename('fo1', 'fo3')
+    assert factory.find_object('fo1') is None
+    assert factory.find_object('fo3') is obj1
+    factory.delete('fo2', 'fo3')
+    assert factory.find_object('fo2') is None
+    eq_(factory.find_objects('fo*'), [])
+
+
+def test_del_node_rollback():
+    "Deleted objects go out of the lookups and come back in place"
+    ids = [x.obj_id for x in factory.cib_objects]
+    node = factory.find_object('ha-two')
+    factory._push_state()
+    try:
+        factory._remove_obj(node)
+        assert factory.find_object('ha-two') is None
+        assert factory.find_object('2') is None
+        assert 'ha-two' not in factory.node_id_list()
+    finally:
+        factory._pop_state()
+    assert factory.find_object('ha-two') is node
+    eq_(ids, [x.obj_id for x in factory.cib_objects])
+
+
+def test_related_constraints():
+    "Reverse references follow create, rename and delete"
+    xml = '''<primitive class="ocf" id="%s" provider="pacemaker" type="Dummy"/>'''
+    prim1 = factory.create_from_node(etree.fromstring(xml % ('rc1')))
+    factory.create_from_node(etree.fromstring(xml % ('rc2')))
+    col = factory.create_from_node(etree.fromstring(
+        '<rsc_colocation id="rc-col" rsc="rc1" with-rsc="rc2" score="INFINITY"/>'))
+    tag = factory.create_from_node(etree.fromstring(
+        '<tag id="rc-tag"><obj_ref id="rc1"/></tag>'))
+    eq_(factory.related_constraints(prim1), [col])
+    eq_(factory.related_elements(prim1), [col, tag])
+    factory.rename('rc1', 'rc3')
+    eq_(col.node.get('rsc'), 'rc3')
+    eq_(factory.related_constraints(prim1), [col])
+    factory.delete('rc3')
+    assert factory.find_object('rc-col') is None
+    prim2 = factory.find_object('rc2')
+    eq_(factory.related_constraints(prim2), [])
+    col2 = factory.create_from_node(etree.fromstring(
+        '<rsc_location id="rc-loc" rsc="rc2" node="ha-one" score="100"/>'))
+    eq_(factory.related_constraints(prim2), [col2])
+    factory.delete('rc-loc')
+    eq_(factory.related_constraints(prim2), [])
+    eq_(factory.find_objects('rc-*'), [tag])
+    factory.delete('rc2', 'rc-tag')
+    eq_(factory.find_objects('rc*'), [])
+
+
+def test_template_primitives():
+    tmpl = factory.create_from_node(etree.fromstring(
+        '<template id="tp-tmpl" class="ocf" provider="pacemaker" type="Dummy"/>'))
+    prim = factory.create_from_node(etree.fromstring(
+        '<primitive id="tp-prim" template="tp-tmpl"/>'))
+    eq_(factory.template_primitives(tmpl), [prim])
+    factory.delete('tp-tmpl')
+    assert factory.find_object('tp-prim') is None
+
+
+def test_rollback():
+    "A failed update leaves the CIB as it was"
+    from crmsh import idmgmt
+    setobj = cibconfig.mkset_obj()
+    ok = setobj.save('''primitive rb1 ocf:pacemaker:Dummy
+primitive rb2 ocf:pacemaker:Dummy
+primitive rb3 ocf:pacemaker:Dummy
+group rb-grp rb3
+colocation rb-col inf: rb1 rb2
+''', no_remove=True, method='update')
+    assert ok
+    before = etree.tostring(factory.cib_elem)
+    ids = [x.obj_id for x in factory.cib_objects]
+    id_store = dict(idmgmt._id_store)
+    setobj = cibconfig.mkset_obj('rb1', 'rb2', 'rb3', 'rb-grp', 'rb-col')
+    ok = setobj.save('''primitive rb2 ocf:pacemaker:Dummy params a=b
+group rb-grp rb2 rb3
+location rb-loc rb1 100: ha-one
+order rb-bad Mandatory: rb1 rb-missing
+''')
+    assert not ok
+    eq_(before, etree.tostring(factory.cib_elem))
+    eq_(ids, [x.obj_id for x in factory.cib_objects])
+    eq_(id_store, idmgmt._id_store)
+    assert factory.check_structure()
+    eq_(factory.find_object('rb3').parent, factory.find_object('rb-grp'))
+    eq_(factory.related_constraints(factory.find_object('rb1')),
+        [factory.find_object('rb-col')])
+    factory.delete('rb-col', 'rb-grp', 'rb1', 'rb2', 'rb3')
+
+
+def _apply_patch(cib, diff):
+    for change in diff.iterchildren("change"):
+        target = cib.xpath(change.get("path"))[0]
+        op = change.get("operation")
+        if op == "delete":
+            target.getparent().remove(target)
+        elif op == "create":
+            target.insert(int(change.get("position")), copy.deepcopy(change[0]))
+        elif op == "modify":
+            for attr in change.find("change-list"):
+                if attr.get("operation") == "set":
+                    target.set(attr.get("name"), attr.get("value"))
+                else:
+                    del target.attrib[attr.get("name")]
+
+
+def test_native_diff():
+    "The generated patch turns the original CIB into the new one"
+    from crmsh import xmlutil
+    old = etree.fromstring('''<cib epoch="3" validate-with="pacemaker-1.2">
+<configuration><crm_config/><resources>
+<primitive id="nd1" class="ocf" provider="pacemaker" type="Dummy"/>
+<primitive id="nd2" class="ocf" provider="pacemaker" type="Dummy"/>
+<group id="nd-grp">
+<primitive id="nd3" class="ocf" provider="pacemaker" type="Dummy"/>
+<primitive id="nd4" class="ocf" provider="pacemaker" type="Dummy"/>
+</group>
+</resources><constraints>
+<rsc_colocation id="nd-col" rsc="nd1" with-rsc="nd2" score="INFINITY"/>
+</constraints></configuration></cib>''', etree.XMLParser(remove_blank_text=True))
+    old.set("crm_feature_set", "3.0.9")
+    new = copy.deepcopy(old)
+    new.set("epoch", "4")
+    new.set("validate-with", "pacemaker-2.0")
+    del new.attrib["crm_feature_set"]
+    rscs = new.find("configuration/resources")
+    removed = [rscs[0]]
+    rscs.remove(rscs[0])
+    rscs[0].set("type", "Stateful")
+    grp = rscs[1]
+    etree.SubElement(rscs, "primitive", id="nd5", type="Dummy")
+    rscs.insert(0, etree.Element("primitive", id="nd6", type="Dummy"))
+    order = etree.SubElement(new.find("configuration/constraints"), "rsc_order",
+                             id="nd-ord", first="nd2", then="nd-grp")
+    col = new.find("configuration/constraints")[0]
+    col.set("score", "100")
+    # only the flagged and removed elements are looked at
+    grp.set("ignored", "true")
+    diff = xmlutil.cib_patch(old, new, set([rscs[1], rscs[0], rscs[3], order, col]), removed)
+    eq_(diff.get("format"), "2")
+    eq_(diff.find("version"), None)
+    eq_(diff.find("change/change-result/cib").get("epoch"), None)
+    orig = copy.deepcopy(old)
+    _apply_patch(old, diff)
+    eq_(old.get("epoch"), "3")
+    old.set("epoch", "4")
+    del grp.attrib["ignored"]
+    eq_(etree.tostring(old), etree.tostring(new))
+    eq_(len(xmlutil.cib_patch(old, new, set(rscs.iter("primitive")), [])), 0)
+    # duplicate ids cannot be addressed
+    rscs.append(copy.deepcopy(grp))
+    eq_(xmlutil.cib_patch(old, new, set([grp]), []), None)
+    # a child removed from a group which is not flagged
+    new = copy.deepcopy(orig)
+    grp = new.find("configuration/resources/group")
+    removed = [grp[0]]
+    grp.remove(grp[0])
+    diff = xmlutil.cib_patch(orig, new, set(), removed)
+    eq_([c.get("operation") for c in diff], ["delete", "create"])
+    _apply_patch(orig, diff)
+    eq_(etree.tostring(orig), etree.tostring(new))
+
+
+def test_native_diff_order():
+    "Reordered children are changes, whitespace is not"
+    from crmsh import xmlutil
+    old = etree.fromstring('''<cib epoch="3"><configuration><resources>
+  <group id="no-grp">
+    <primitive id="no1" class="ocf" provider="pacemaker" type="Dummy"/>
+    <primitive id="no2" class="ocf" provider="pacemaker" type="Dummy">
+      <operations>
+        <op id="no2-start" name="start" interval="0"/>
+        <op id="no2-monitor" name="monitor" interval="10s"/>
+      </operations>
+    </primitive>
+  </group>
+</resources></configuration></cib>''')
+    new = etree.fromstring(etree.tostring(old), etree.XMLParser(remove_blank_text=True))
+    grp = new.find("configuration/resources/group")
+    eq_(len(xmlutil.cib_patch(old, new, set([grp]), [])), 0)
+    ops = grp.find("primitive/operations")
+    ops.append(ops[0])
+    diff = xmlutil.cib_patch(old, new, set([grp]), [])
+    eq_([c.get("operation") for c in diff], ["delete", "create"])
+    _apply_patch(old, diff)
+    eq_([op.get("id") for op in old.iter("op")], ["no2-monitor", "no2-start"])
+    grp.append(grp[0])
+    diff = xmlutil.cib_patch(old, new, set([grp]), [])
+    _apply_patch(old, diff)
+    eq_([p.get("id") for p in old.iter("primitive")], ["no2", "no1"])
+
+
+def test_lazy_check():
+    "Objects loaded from the CIB are checked on first use"
+    f = cibconfig.CibFactory()
+    ok = f.initialize(cib='''<cib epoch="0" num_updates="0" admin_epoch="0" validate-with="pacemaker-1.2">
+<configuration><crm_config/><nodes/><resources>
+<primitive id="lz1" class="ocf" provider="pacemaker" type="Dummy">
+<instance_attributes id="lz1-instance_attributes"/>
+<!--moved-->
+</primitive>
+</resources><constraints/></configuration><status/></cib>''')
+    assert ok
+    obj = f.find_object('lz1')
+    assert obj._unchecked
+    # comments are normalized on load, before any journaling
+    eq_(obj.node[1].text, "# moved")
+    eq_(obj.nocli, False)
+    assert not obj._unchecked
+
+
+def test_lazy_check_nopretty():
+    "Checking objects on first use leaves pretty printing alone"
+    import os
+    import shutil
+    import tempfile
+    from crmsh import clidisplay
+
+    def fresh_set():
+        f = cibconfig.CibFactory()
+        assert f.initialize(cib='''<cib epoch="0" num_updates="0" admin_epoch="0" validate-with="pacemaker-1.2">
+<configuration><crm_config/><nodes><node id="np1" uname="np1"/></nodes><resources>
+<primitive id="np-rsc" class="ocf" provider="pacemaker" type="Dummy"/>
+</resources><constraints/></configuration><status/></cib>''')
+        setobj = cibconfig.mkset_obj()
+        setobj.obj_set = cibconfig.oset(f.cib_objects)
+        return setobj
+
+    assert clidisplay.colors_enabled()
+    s = fresh_set().repr_nopretty()
+    assert s.find("node np1") >= 0
+    assert s.find("${") < 0, s
+    assert clidisplay.colors_enabled()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, "cib.txt")
+        assert fresh_set().save_to_file(fname)
+        s = open(fname).read()
+    finally:
+        shutil.rmtree(tmpdir)
+    assert s.find("primitive np-rsc") >= 0
+    assert s.find("${") < 0, s
+    assert clidisplay.colors_enabled()
+
+
+def test_cli_cache():
+    "The CLI representation is cached until the object changes"
+    setobj = cibconfig.mkset_obj()
+    ok = setobj.save('''primitive cc1 ocf:pacemaker:Dummy
+group cc-grp cc1
+''', no_remove=True, method='update')
+    assert ok
+    obj = factory.find_object('cc1')
+    grp = factory.find_object('cc-grp')
+    s = obj.repr_cli(format=-1)
+    assert obj.repr_cli(format=-1) is s
+    grp.repr_cli(format=-1)
+    setobj = cibconfig.mkset_obj('cc1')
+    ok = setobj.save('''primitive cc1 ocf:pacemaker:Dummy params state=1''')
+    assert ok
+    eq_(obj.repr_cli(format=-1), "primitive cc1 ocf:pacemaker:Dummy params state=1")
+    assert not grp._cli_cache
+    factory.delete('cc-grp', 'cc1')
+
+
+def test_edit_unchanged():
+    "Objects left alone in the editor are neither parsed nor updated"
+    setobj = cibconfig.mkset_obj()
+    ok = setobj.save('''# first one
+primitive eu1 ocf:pacemaker:Dummy
+primitive eu2 ocf:pacemaker:Dummy
+group eu-grp eu1 eu2
+''', no_remove=True, method='update')
+    assert ok
+    setobj = cibconfig.mkset_obj('eu1', 'eu2', 'eu-grp')
+    s = setobj._edit_repr()
+    s = s.replace("primitive eu2 ocf:pacemaker:Dummy",
+                  "primitive eu2 ocf:pacemaker:Dummy params state=2")
+    eu1, eu_grp = factory.find_object('eu1'), factory.find_object('eu-grp')
+    nodes = (eu1.node, eu_grp.node)
+    eu1_updated = eu1.updated
+    modified = factory.modified_elems()
+    ok = setobj.save(s)
+    assert ok
+    eq_((eu1.node, eu_grp.node), nodes)
+    eq_(eu1.updated, eu1_updated)
+    assert factory.find_object('eu2').updated
+    eq_(factory.modified_elems(), modified)
+    eq_(factory.find_object('eu1').repr_cli(format=-1),
+        "# first one\nprimitive eu1 ocf:pacemaker:Dummy")
+    eq_(factory.find_object('eu2').repr_cli(format=-1),
+        "primitive eu2 ocf:pacemaker:Dummy params state=2")
+    factory.delete('eu-grp', 'eu1', 'eu2')
+
+
+def test_obj_set2xml():
+    "Objects are serialized straight from the CIB"
+    setobj = cibconfig.mkset_obj()
+    ok = setobj.save('''primitive sx1 ocf:pacemaker:Dummy op monitor interval=10s
+primitive sx2 ocf:pacemaker:Dummy
+group sx-grp sx2
+''', no_remove=True, method='update')
+    assert ok
+    objs = [factory.find_object(x) for x in ('sx1', 'sx2', 'rsc-options')]
+    s = ''.join(factory.obj_set2xml(objs))
+    cib = etree.fromstring(s)
+    eq_(cib.get("validate-with"), factory.cib_attrs["validate-with"])
+    eq_(cib.xpath("configuration/resources/*/@id"), ['sx1', 'sx-grp'])
+    eq_(len(cib.xpath("configuration/rsc_defaults/meta_attributes")), 1)
+    eq_(''.join(factory.obj_set2xml(objs, pretty_print=True)),
+        etree.tostring(cib, pretty_print=True))
+    factory.delete('sx-grp', 'sx1', 'sx2')
+
+
+def test_cibdump_cache():
+    "CIB dumps are reused while the CIB version stays the same"
+    from crmsh import xmlutil
+    commands = []
+    version = ['1']
+    probe_works = [True]
+
+    def mock_sudocall(cmd):
+        commands.append(cmd)
+        if cmd == xmlutil.cib_version_dump:
+            if not probe_works[0]:
+                return 1, '', 'cibadmin: unrecognized option'
+            return 0, '<cib admin_epoch="0" epoch="%s" num_updates="0"/>' % version[0], ''
+        if cmd.endswith("-o resources"):
+            return 0, '<resources/>', ''
+        return 0, '<cib admin_epoch="0" epoch="%s" num_updates="0"><configuration/></cib>' % \
+            version[0], ''
+
+    saved = xmlutil.sudocall, xmlutil._version_probe
+    try:
+        xmlutil.sudocall = mock_sudocall
+        xmlutil._version_probe = True
+        xmlutil.clear_cibdump_cache()
+        e1 = xmlutil.cached_cibdump2elem()
+        # nothing cached yet, no need for the version
+        eq_(commands, [xmlutil.cib_dump])
+        e2 = xmlutil.cached_cibdump2elem()
+        assert e1 is e2
+        eq_(len([x for x in commands if x == xmlutil.cib_dump]), 1)
+        version[0] = '2'
+        e3 = xmlutil.cached_cibdump2elem()
+        eq_(e3.get("epoch"), '2')
+        xmlutil.clear_cibdump_cache()
+        assert xmlutil.cached_cibdump2elem() is not e3
+        eq_(len([x for x in commands if x == xmlutil.cib_dump]), 3)
+        # a section is cached with the version asked for first
+        del commands[:]
+        r1 = xmlutil.cached_cibdump2elem("resources")
+        assert xmlutil.cached_cibdump2elem("resources") is r1
+        eq_(commands, [xmlutil.cib_version_dump, xmlutil.cib_dump + " -o resources",
+                       xmlutil.cib_version_dump])
+        # the version cannot be had: no more tries, no caching
+        probe_works[0] = False
+        del commands[:]
+        xmlutil.cached_cibdump2elem()
+        xmlutil.cached_cibdump2elem()
+        eq_(commands, [xmlutil.cib_version_dump, xmlutil.cib_dump, xmlutil.cib_dump])
+        # nor with a pacemaker too old for it
+        xmlutil._version_probe = None
+        saved_ver = constants.pcmk_version
+        try:
+            constants.pcmk_version = "1.1.12"
+            del commands[:]
+            xmlutil.cached_cibdump2elem()
+            eq_(commands, [xmlutil.cib_dump])
+        finally:
+            constants.pcmk_version = saved_ver
+    finally:
+        xmlutil.sudocall, xmlutil._version_probe = saved
+        xmlutil.clear_cibdump_cache()
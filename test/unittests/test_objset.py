@@ -48,3 +48,17 @@ def test_show():
     s = setobj.repr_nopretty()
     sp = s.splitlines()
     assert_in("node 1: ha-one", sp[0:3])
+
+
+def test_save_to_file():
+    import os
+    import shutil
+    import tempfile
+    setobj = cibconfig.mkset_obj()
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, "save.crm")
+    try:
+        assert setobj.save_to_file(fname)
+        eq_(open(fname).read(), setobj.repr_nopretty() + '\n')
+    finally:
+        shutil.rmtree(tmpdir)
@@ -543,6 +543,87 @@ class TestCliParser(unittest.TestCase):
         ok_('value' not in verbose[0].attrib)
 
 
+    def test_parse_statements(self):
+        from crmsh.msg import err_buf
+        statements = lines2cli('''
+        # first
+        primitive d1 ocf:pacemaker:Dummy
+        primitive d2 ocf:pacemaker:Dummy \\
+          op monitor interval=60s
+        group g1 d1 d2
+        # second
+        # third
+        primitive d3 ocf:pacemaker:Dummy
+        location l1 g1 100: node1
+        colocation c1 inf: d3 g1 (
+        order o1 Mandatory: d3 g1
+        # trailing
+        ''')
+
+        def parse_all(jobs=1, chunk_size=None):
+            err_buf.buffer()
+            err_buf.start_tmp_lineno()
+            try:
+                out = [n if n in (False, None) else etree.tostring(n)
+                       for n in parse.parse_statements(statements, jobs, chunk_size)]
+                return out, err_buf.msg_list
+            finally:
+                err_buf.stop_tmp_lineno()
+                err_buf.msg_list = []
+                err_buf.mode = "immediate"
+
+        expected = parse_all()
+        eq_([n is None for n in expected[0]],
+            [True, False, False, False, True, True, False, False, False, False, True])
+        eq_(expected[0][8], False)
+        eq_(len(expected[1]), 1)
+        ok_(expected[1][0].find(" 9: ") >= 0)
+        ok_(expected[0][6].find('<!--# second--><!--# third-->') >= 0)
+
+        eq_(parse_all(jobs=2, chunk_size=2), expected)
+
+    def test_replayed_messages(self):
+        "Worker messages keep their level, warnings once are shown once"
+        from crmsh.msg import err_buf
+        chunks = []
+        for i in range(2):
+            err_buf.record()
+            err_buf.one_warning("replay-once")
+            err_buf.error("replay-err")
+            chunks.append(err_buf.recorded)
+        err_buf.recorded = None
+        eq_(chunks[0], [("one_warning", "replay-once"), ("error", "replay-err")])
+        err_buf.buffer()
+        try:
+            for msgs in chunks:
+                err_buf.replay(msgs)
+            l = err_buf.msg_list
+        finally:
+            err_buf.msg_list = []
+            err_buf.mode = "immediate"
+            err_buf.written.pop("replay-once", None)
+        eq_(len([m for m in l if m.endswith("WARNING: replay-once")]), 1)
+        eq_(len([m for m in l if m.endswith("ERROR: replay-err")]), 2)
+
+    def test_parse_workers_providers(self):
+        from crmsh import cache
+        statements = lines2cli('''
+        primitive p1 Dummy
+        primitive p2 ocf:IPaddr2 op monitor interval=10s
+        primitive p3 ocf:heartbeat:Filesystem
+        primitive p4 lsb:ntp
+        primitive p5 @tpl1
+        rsc_template tpl1 apache
+        # primitive p6 nfsserver
+        group g1 p1 p2
+        ''')
+        eq_(parse._ocf_types(statements), set(["Dummy", "IPaddr2", "apache"]))
+        try:
+            parse._init_worker({"Dummy": ["heartbeat", "pacemaker"]})
+            eq_(cache.retrieve("ra_providers", "ocf:Dummy"), ["heartbeat", "pacemaker"])
+        finally:
+            cache.invalidate("ra_providers", "ocf:Dummy")
+
     def test_configs(self):
         outp = self._parse_lines('''
         primitive rsc_dummy ocf:heartbeat:Dummy
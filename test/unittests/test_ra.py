@@ -0,0 +1,164 @@
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+# unit tests for ra.py
+
+import os
+import copy
+import shutil
+import tempfile
+from crmsh import cache
+from crmsh import ra
+from nose.tools import eq_
+
+_META = """<?xml version="1.0"?>
+<resource-agent name="Fake">
+<parameters>
+<parameter name="state" unique="1"><content type="string"/></parameter>
+<parameter name="fake" required="1"><content type="string" default="dummy"/></parameter>
+</parameters>
+<actions>
+<action name="start" timeout="20"/>
+<action name="stop" timeout="20"/>
+<action name="monitor" timeout="20" interval="10" depth="0"/>
+<action name="meta-data" timeout="5"/>
+</actions>
+</resource-agent>"""
+
+
+class _FakeRaIf(object):
+    def __init__(self):
+        self.calls = 0
+
+    def meta(self, ra_class, ra_type, ra_provider):
+        self.calls += 1
+        return _META.split('\n')
+
+
+def test_meta_store():
+    tmpdir = tempfile.mkdtemp()
+    agent = os.path.join(tmpdir, "resource.d", "test", "Fake")
+    os.makedirs(os.path.dirname(agent))
+    open(agent, "w").write("#!/bin/sh\n")
+    fake = _FakeRaIf()
+    store_dir = os.path.join(tmpdir, "cache")
+    saved = (os.environ["OCF_ROOT"], ra._meta_store_dir, ra.ra_if)
+    try:
+        os.environ["OCF_ROOT"] = tmpdir
+        ra._meta_store_dir = lambda: store_dir
+        ra.ra_if = lambda: fake
+        cache.invalidate()
+        params = ra.RAInfo("ocf", "Fake", "test").params()
+        eq_(fake.calls, 1)
+        eq_(params["fake"], {"required": "1", "unique": None,
+                             "type": "string", "default": "dummy"})
+        path = os.path.join(store_dir, "ocf:test:Fake")
+        ino = os.stat(path).st_ino
+
+        # another process would find everything on disk
+        cache.invalidate()
+        info = ra.RAInfo("ocf", "Fake", "test")
+        eq_(info.params(), params)
+        eq_(sorted(info.actions().keys()), ["monitor", "start", "stop"])
+        eq_(info.meta(), _META.split('\n'))
+        assert isinstance(info.meta()[0], str)
+        eq_(fake.calls, 1)
+        # written once, with all the parts
+        eq_(os.stat(path).st_ino, ino)
+        eq_(os.listdir(store_dir), ["ocf:test:Fake"])
+
+        # the agent changed
+        open(agent, "a").write("exit 0\n")
+        cache.invalidate()
+        eq_(ra.RAInfo("ocf", "Fake", "test").meta(), _META.split('\n'))
+        eq_(fake.calls, 2)
+
+        assert ra.clear_meta_store()
+        assert not os.path.exists(store_dir)
+    finally:
+        os.environ["OCF_ROOT"], ra._meta_store_dir, ra.ra_if = saved
+        cache.invalidate()
+        shutil.rmtree(tmpdir)
+
+
+def test_prefetch():
+    fake = _FakeRaIf()
+    saved = ra.ra_if
+    try:
+        ra.ra_if = lambda: fake
+        cache.invalidate()
+        agents = [ra.RAInfo("ocf", "fake_%d" % (i % 20), "test") for i in range(50)]
+        ra.prefetch_meta(agents)
+        eq_(fake.calls, 20)
+        eq_(agents[-1].params()["fake"]["default"], "dummy")
+        eq_(fake.calls, 20)
+        # only the parsed meta-data is kept
+        eq_(cache.retrieve("ra_schema", agents[-1].ra_string()).name, "Fake")
+        assert "ra_meta" not in [st[0] for st in cache.stats()]
+    finally:
+        ra.ra_if = saved
+        cache.invalidate()
+
+
+def test_providers_map():
+    tmpdir = tempfile.mkdtemp()
+    for prov, ra_type in (("heartbeat", "IPaddr2"), ("heartbeat", "Dummy"),
+                          ("pacemaker", "Dummy")):
+        d = os.path.join(tmpdir, "resource.d", prov)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        open(os.path.join(d, ra_type), "w").close()
+    saved = os.environ["OCF_ROOT"]
+    try:
+        os.environ["OCF_ROOT"] = tmpdir
+        d = ra.RaOS().providers_map()
+        eq_(sorted(d["Dummy"]), ["heartbeat", "pacemaker"])
+        eq_(d["IPaddr2"], ["heartbeat"])
+        eq_(sorted(ra.RaOS().providers("Dummy")), sorted(d["Dummy"]))
+    finally:
+        os.environ["OCF_ROOT"] = saved
+        shutil.rmtree(tmpdir)
+
+
+def test_schema():
+    fake = _FakeRaIf()
+    saved = ra.ra_if
+    try:
+        ra.ra_if = lambda: fake
+        cache.invalidate()
+        info = ra.RAInfo("ocf", "Fake", "test")
+        schema = info.mk_ra_node()
+        eq_([p.name for p in schema.params], ["state", "fake"])
+        eq_(schema.required, frozenset(["fake"]))
+        eq_(schema.unique, frozenset(["state"]))
+        eq_(schema.param("fake").default, "dummy")
+        eq_(info.completion_params(), ["state", "fake"])
+        eq_(info.meta_parameter("fake"), "fake* (string, [dummy]): ")
+        eq_(info.meta_actions().split('\n')[-1],
+            "    monitor       timeout=20 interval=10")
+        eq_(info.reqd_params_list(), ["fake"])
+        # the parsed meta-data is shared
+        assert ra.RAInfo("ocf", "Fake", "test").mk_ra_node() is schema
+
+        other = ra.RAInfo("ocf", "Other", "test")
+        other.schema = schema
+        info = copy.deepcopy(info)
+        info.add_ra_params(other)
+        eq_(len(info.mk_ra_node().params), 4)
+        eq_(len(schema.params), 2)
+    finally:
+        ra.ra_if = saved
+        cache.invalidate()
@@ -0,0 +1,210 @@
+# Copyright (C) 2026 agent <agent@local>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+# unit tests for report.py
+
+import os
+import time
+import shutil
+import tempfile
+from crmsh import report
+from nose.tools import eq_
+
+
+def _log_lines(t0, n):
+    l = []
+    for i in range(n):
+        t = t0 + i / 3 * 7
+        l.append("%s node1 crmd[123]: notice: message number %d\n" %
+                 (time.strftime("%b %d %H:%M:%S", time.localtime(t)), i))
+    return l
+
+
+def _linear_seek(log, ts, to_end):
+    f = open(log)
+    try:
+        while True:
+            pos = f.tell()
+            s = f.readline()
+            if not s:
+                return pos
+            line_ts = report.syslog_ts(s)
+            if line_ts > ts or (not to_end and line_ts == ts):
+                return pos
+    finally:
+        f.close()
+
+
+def _check_seek(log, idx, t0, t1):
+    f = open(log)
+    try:
+        for ts in range(int(t0) - 10, int(t1) + 10, 13):
+            for to_end in (False, True):
+                eq_(idx.seek(f, ts, to_end), _linear_seek(log, ts, to_end))
+    finally:
+        f.close()
+
+
+def test_log_index():
+    report.set_year()
+    tmpdir = tempfile.mkdtemp()
+    log = os.path.join(tmpdir, "ha-log.txt")
+    t0 = int(time.mktime((int(report.YEAR), 3, 1, 10, 0, 0, 0, 0, -1)))
+    try:
+        open(log, "w").write(''.join(_log_lines(t0, 300)))
+        idx = report.LogIndex(log)
+        idx.step = 512
+        assert idx.update()
+        assert os.path.isfile(idx.path())
+        eq_(idx.blocks, (os.path.getsize(log) + 511) / 512)
+        eq_(idx.ts, sorted(idx.ts))
+        _check_seek(log, idx, t0, t0 + 700)
+
+        # the log grows: the index is extended, not rebuilt
+        blocks, pos = idx.blocks, idx.pos[:]
+        open(log, "a").write(''.join(_log_lines(t0 + 700, 300)))
+        idx = report.LogIndex(log)
+        idx.step = 512
+        assert idx.update()
+        assert idx.blocks > blocks
+        eq_(idx.pos[:len(pos)-1], pos[:-1])
+        _check_seek(log, idx, t0, t0 + 1400)
+
+        # the log is rewritten: the index is rebuilt
+        open(log, "w").write(''.join(_log_lines(t0 + 1000, 10)))
+        idx.update()
+        eq_(idx.blocks, (os.path.getsize(log) + 511) / 512)
+        eq_(len(idx.pos), idx.blocks)
+        _check_seek(log, idx, t0 + 1000, t0 + 1030)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_syslog_ts():
+    report.set_year()
+    yr = int(report.YEAR)
+    for s in ("Dec 14 20:07:37 xen-e crmd: [3] info: x",
+              "Mar  4 02:30:00 node1 crmd[123]: notice: y",
+              "Feb 29 10:00:00 node1 z",
+              "Oct 32 10:00:00 node1 z",
+              "Oct 3 10:00 node1 z",
+              "Foo 3 10:00:00 node1 z",
+              "xen-e crmd: [3] info: x"):
+        eq_(report.syslog_ts(s), report._syslog_ts_slow(s))
+        eq_(report.syslog2node(s), report._syslog2node_slow(s))
+    eq_(report.syslog2node("Dec 14 20:07:37 xen-e crmd: [3] info: x"), "xen-e")
+    t = time.mktime((yr, 7, 14, 20, 7, 37, 0, 0, -1))
+    eq_(report.syslog_ts("%d-07-14T20:07:37 node1 crmd" % yr), t)
+    eq_(report.syslog_ts("%d-07-14T20:07:37.25 node1 crmd" % yr), t + 0.25)
+    eq_(report.syslog2node("%d-07-14T20:07:37.25 node1 crmd" % yr), "node1")
+    t = time.mktime((yr, 7, 14, 20, 7, 37, 0, 0, 0))
+    eq_(report.syslog_ts("%d-07-14T20:07:37.123456+02:00 node1 crmd" % yr), t + 0.123456)
+
+
+def test_search_logs():
+    report.set_year()
+    tmpdir = tempfile.mkdtemp()
+    t0 = int(time.mktime((int(report.YEAR), 3, 1, 10, 0, 0, 0, 0, -1)))
+    try:
+        log_l = []
+        for i, node in enumerate(("node1", "node2", "node3")):
+            os.mkdir(os.path.join(tmpdir, node))
+            log = os.path.join(tmpdir, node, "ha-log.txt")
+            lines = [s.replace("node1", node) for s in _log_lines(t0 + i, 100)]
+            open(log, "w").write(''.join(lines))
+            log_l.append(log)
+        logobj = report.LogSyslog(None, log_l[:], None, None)
+        l = list(logobj.search_logs(log_l, "number [0-9]*7$"))
+        eq_(len(l), 30)
+        ts_l = [report.syslog_ts(s) for s in l]
+        eq_(ts_l, sorted(ts_l))
+        eq_(len(logobj.get_matches(["number"], log_l[1:2])), 100)
+        eq_(set(report.syslog2node(s) for s in logobj.get_matches([], log_l[:2])),
+            set(["node1", "node2"]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_matching_run_msg():
+    invoke = "Dec 14 20:06:57 xen-e pengine: [24227]: notice: process_pe_message: " + \
+        "Transition %d: PEngine Input stored in: /var/lib/pengine/pe-input-%d.bz2"
+    run = "Dec 14 20:06:57 xen-e crmd: [24228]: notice: run_graph: ==== Transition %d " + \
+        "(Complete=2, Pending=0, Fired=0, Skipped=0, Incomplete=0, " + \
+        "Source=/var/lib/pengine/pe-input-%d.bz2): Complete"
+    msg_l = []
+    for n in (112, 12, 3, 13):
+        msg_l += [invoke % (n, n), run % (n, n)]
+    msg_l.append(run % (99, 3))
+    d = report.run_msg_index(msg_l)
+    eq_(sorted(d.keys()), ["112", "12", "13", "3"])
+    for n in (112, 12, 3, 13):
+        eq_(report.get_matching_run_msg(invoke % (n, n), d), run % (n, n))
+    eq_(report.get_matching_run_msg(invoke % (4, 4), d), "")
+
+
+def test_pe_index():
+    import bz2
+    tmpdir = tempfile.mkdtemp()
+    pe_file = os.path.join(tmpdir, "node1", "pengine", "pe-input-1.bz2")
+    os.makedirs(os.path.dirname(pe_file))
+    cib = '<cib epoch="5" admin_epoch="0" num_updates="10" dc-uuid="node1" ' + \
+        'update-client="cibadmin" update-user="root" have-quorum="1">' + \
+        '<configuration>%s</configuration><status/></cib>' % ('<nodes/>' * 10000)
+    open(pe_file, "w").write(bz2.compress(cib))
+    try:
+        idx = report.PeIndex(tmpdir)
+        attrs = idx.get(pe_file)
+        eq_(attrs["epoch"], "5")
+        eq_(attrs["update-user"], "root")
+        assert "have-quorum" not in attrs
+        idx.save()
+        assert os.path.isfile(idx.path())
+
+        # read from the saved index, not from the PE input
+        idx = report.PeIndex(tmpdir)
+        eq_(idx.get(pe_file), attrs)
+        assert not idx.dirty
+
+        open(pe_file, "w").write(bz2.compress(cib.replace('epoch="5"', 'epoch="6"')))
+        os.utime(pe_file, (1, 1))
+        eq_(report.PeIndex(tmpdir).get(pe_file)["epoch"], "6")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_mkarchive():
+    "Our index files stay out of the report archive"
+    import tarfile
+    tmpdir = tempfile.mkdtemp()
+    rpt = os.path.join(tmpdir, "report")
+    os.makedirs(os.path.join(rpt, "node1"))
+    for name in ("ha-log.txt", "ha-log.txt" + report.LogIndex.suffix,
+                 report.PeIndex.index_file, "node1/ha-log.txt"):
+        open(os.path.join(rpt, name), "w").write("x\n")
+    saved = os.environ.get("HOME")
+    try:
+        os.environ["HOME"] = tmpdir
+        assert report.mkarchive(rpt)
+        tar = tarfile.open(os.path.join(tmpdir, "report.tar.bz2"))
+        eq_(sorted(m.name for m in tar.getmembers() if m.isfile()),
+            ["report/ha-log.txt", "report/node1/ha-log.txt"])
+        tar.close()
+    finally:
+        if saved is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = saved
+        shutil.rmtree(tmpdir)
@@ -44,3 +44,49 @@ def test_maintenance():
         assert commands[-1] == ("crm_resource -r 'rsc1' --meta -p maintenance -v 'false'",)
     finally:
         utils.ext_cmd = _pre_ext_cmd
+
+
+def test_rsc_state():
+    from lxml import etree
+    from crmsh import xmlutil
+    commands = []
+
+    def mock_get_stdout(cmd, **kwargs):
+        commands.append(cmd)
+        return 0, '''<crm_mon version="1.1.12"><resources>
+<resource id="st1" role="Started" active="true"/>
+<resource id="st2" role="Stopped" active="false"/>
+<clone id="st-clone">
+<resource id="st3:0" role="Started" active="true"/>
+<resource id="st3:1" role="Stopped" active="false"/>
+</clone>
+<group id="st-grp">
+<resource id="st4" role="Started" active="true"/>
+</group>
+</resources></crm_mon>'''
+
+    def mock_cibdump2elem(section=None):
+        return etree.fromstring('''<configuration><resources>
+<primitive id="st1"/><primitive id="st2"/>
+<clone id="st-clone"><primitive id="st3"/></clone>
+<group id="st-grp"><primitive id="st4"/></group>
+</resources></configuration>''')
+
+    saved = (xmlutil.get_stdout, xmlutil.cibdump2elem, xmlutil.is_live_cib)
+    try:
+        xmlutil.get_stdout = mock_get_stdout
+        xmlutil.cibdump2elem = mock_cibdump2elem
+        xmlutil.is_live_cib = lambda: True
+        rscstat = xmlutil.RscState()
+        assert rscstat.is_running('st1')
+        assert not rscstat.is_running('st2')
+        assert rscstat.is_running('st3')
+        assert rscstat.is_running('st-clone')
+        assert rscstat.is_running('st-grp')
+        assert rscstat.is_group('st-grp')
+        assert rscstat.rsc_clone('st3') == 'st-clone'
+        assert not rscstat.can_delete('st1')
+        assert rscstat.can_delete('st2')
+        assert commands == [xmlutil.RscState.mon_status]
+    finally:
+        xmlutil.get_stdout, xmlutil.cibdump2elem, xmlutil.is_live_cib = saved
@@ -135,3 +135,98 @@ def test_msec():
     assert utils.crm_msec('1') == 1000
     assert utils.crm_msec('1m') == 60*1000
     assert utils.crm_msec('1h') == 60*60*1000
+
+
+def test_tokenize():
+    import random
+    import shlex
+
+    def split(s):
+        try:
+            return shlex.split(s)
+        except ValueError, msg:
+            return str(msg)
+
+    def tokenize(s):
+        try:
+            return utils.tokenize(s)
+        except ValueError, msg:
+            return str(msg)
+
+    for s in ('primitive p1 Dummy meta description="a b"',
+              "location l1 p1 rule -inf: not_defined pingd or pingd lte 0",
+              'op monitor interval=10s timeout="20s" \\\n',
+              'a"b c"d \'e\\f\' g\\ h "i\\"j\\k" ""',
+              'a "b', "a 'b", 'a \\', 'a "b\\', '\fa\vb'):
+        assert tokenize(s) == split(s), repr(s)
+    r = random.Random(0)
+    chars = ['a', 'b=', ' ', '\t', '\n', '\r', '\f', "'", '"', '\\', '#']
+    for i in range(5000):
+        s = ''.join(r.choice(chars) for _ in range(r.randint(0, 10)))
+        assert tokenize(s) == split(s), repr(s)
+
+
+def test_calltrace():
+    from crmsh import calltrace
+    saved = calltrace._target, calltrace._calls[:]
+    try:
+        calltrace._target = "summary"
+        calltrace.set_command("configure.show")
+        rc, s = utils.get_stdout("echo hello", input_s="abc")
+        assert s == "hello"
+        rc = utils.ext_cmd_nosudo("exit 3")
+        assert rc == 3
+        call = calltrace._calls[-2]
+        assert call["argv"] == "echo hello"
+        assert call["rc"] == 0
+        assert call["bytes_in"] == 3 and call["bytes_out"] == 6
+        assert call["command"] == "configure.show"
+        d = dict((st[0], st) for st in calltrace.summary())
+        assert d["echo"][1:3] == (1, 0)
+        assert d["exit"][1:3] == (1, 1)
+        assert calltrace._program("sudo -E -u hacluster LANG=C /usr/sbin/cibadmin -Ql") == "cibadmin"
+    finally:
+        calltrace._target = saved[0]
+        calltrace._calls[:] = saved[1]
+        calltrace.set_command(None)
+
+
+def test_pipe_strings_capture():
+    # more than a pipe buffer each way, while the input is
+    # still being written
+    lines = ("line %d\n" % i for i in xrange(20000))
+    rc, outp, errp = utils.pipe_strings("cat; echo done >&2; exit 1", lines, capture=True)
+    assert rc == 1
+    assert outp == '\n'.join("line %d" % i for i in xrange(20000))
+    assert errp == "done"
+
+
+def test_profiler():
+    import sys
+    import shutil
+    import tempfile
+    import StringIO
+    from crmsh import profiler
+    tmpdir = tempfile.mkdtemp()
+    saved = profiler.profile_dir, dict(profiler._totals), sys.stderr
+    try:
+        profiler.profile_dir = lambda: os.path.join(tmpdir, "profile")
+        profiler._totals.clear()
+        sys.stderr = StringIO.StringIO()
+        assert profiler.run("configure.show", lambda a, b: a + b, 1, 2) == 3
+        profiler.run("configure.show", lambda: None)
+        profiler.run("status", lambda: None)
+        assert "profile: configure.show:" in sys.stderr.getvalue()
+        # the profile of a command is replaced by the next one
+        assert sorted(os.listdir(os.path.join(tmpdir, "profile"))) == \
+            ["configure.show.prof", "status.prof"]
+        names = [st[0] for st in profiler.summary()]
+        assert set(names) == set(["configure", "configure.show", "(top)", "status"])
+        assert names.index("configure") + 1 == names.index("configure.show")
+        d = dict((st[0], st[1]) for st in profiler.summary())
+        assert d["configure"] == 2 and d["status"] == 1
+    finally:
+        profiler.profile_dir, sys.stderr = saved[0], saved[2]
+        profiler._totals.clear()
+        profiler._totals.update(saved[1])
+        shutil.rmtree(tmpdir)